@@ -0,0 +1 @@
+``PortletManager.getAddablePortletTypes()`` now caches the addable portlet types for each set of interfaces a portlet manager provides. The cache is invalidated when portlet types are registered, unregistered or have their ``for_`` changed.
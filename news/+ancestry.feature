@@ -0,0 +1 @@
+Resolve the portlet ancestry of a context, i.e. the ``IPortletContext``, ``ILocalPortletAssignable``, annotations and ``ILocalPortletAssignmentManager`` adaptations of it and its parents, once per request and share it between all portlet managers.
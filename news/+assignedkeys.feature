@@ -0,0 +1,4 @@
+``PortletCategoryMapping`` now keeps a summary of the keys that have portlets assigned, available through ``assignedKeys()``.
+The retrievers use it to skip keys without assignments, so users in many groups no longer cause a lookup per group.
+The summary is kept in its own ``OOTreeSet``, so that portlets can be added for different keys at the same time without conflicts.
+Category mappings created by older versions need to be migrated with ``migrateAssignedKeys()``; until then every key is looked up.
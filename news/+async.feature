@@ -0,0 +1,3 @@
+Add the ``updateAsync()`` and ``renderAsync()`` coroutines to ``PortletManagerRenderer``.
+Renderers that provide the new ``IAsyncPortletRenderer`` are awaited concurrently.
+Output is still joined in assignment order.
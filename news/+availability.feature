@@ -0,0 +1,3 @@
+Portlet assignments and data providers can declare when they are available by setting ``__portlet_availability__`` to a ``plone.portlets.availability.PortletAvailability``.
+The declaration can limit a portlet by content type, by whether the user is authenticated, or to a time window.
+Unavailable portlets are skipped before their renderer is looked up.
@@ -0,0 +1,2 @@
+Add ``IPortletBatchRetriever``, which looks up the portlets for several portlet managers with a single walk of the content hierarchy.
+``PortletManagerRenderer`` can share such a lookup between all portlet managers rendered during a request by setting ``batch_retrieval`` to True.
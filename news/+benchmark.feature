@@ -0,0 +1,2 @@
+Add ``plone.portlets.benchmark``, which times portlet retrieval and loading for a synthetic content hierarchy of configurable depth, fan-out, group memberships, blocking and portlets per mapping, and prints the results as JSON.
+Run it with ``python -m plone.portlets.benchmark --help``.
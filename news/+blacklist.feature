@@ -0,0 +1 @@
+Blacklist statuses are now stored in an ``OOBTree`` with a ``BlacklistStatuses`` mapping for each portlet manager. Concurrent changes to the statuses of different portlet managers or categories are resolved instead of raising ``ConflictError``. Existing blacklists are migrated in place when a status is next set, or by calling ``plone.portlets.assignable.migrateBlacklist()``.
@@ -0,0 +1,2 @@
+Add ``ILocalPortletAssignmentManager.getBlacklistStatuses()``, which returns all blacklist statuses set at a context in one call.
+The default portlet retriever uses it to read the blacklist once per parent, rather than once per category and parent.
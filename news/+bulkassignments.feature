@@ -0,0 +1 @@
+Added ``addMany()`` and ``removeMany()`` to ``PortletAssignmentMapping`` and ``PortletCategoryMapping``. They fire the usual container events, but write the order and the summaries kept by the mappings once, notify the container of modification once, and update the portlet indexes once. Re-ordering is already done with one write by ``updateOrder()``.
@@ -0,0 +1,2 @@
+Add an optional ``IPortletCircuitBreaker`` utility, implemented by ``plone.portlets.breaker.PortletCircuitBreaker``.
+Portlets that repeatedly exceed their render time budget are not rendered for a cool-down period; their last good output, or the error message, is shown instead.
@@ -0,0 +1,2 @@
+``PortletManagerRenderer`` can render portlets whose renderer provides ``IDeferredPortletRenderer`` as a placeholder carrying the portlet hash, by setting ``deferred_rendering`` to True.
+The new ``plone.portlets.fragment.PortletFragment`` view renders such a portlet on its own; applications register it as needed.
@@ -0,0 +1 @@
+Add ``IHashIndexedPortletManager``. Portlet managers marked with it keep a persistent index of their assignments by portlet hash. ``plone.portlets.hashindex.lookupAssignment()`` finds the assignment for a hash with one lookup, checking that the index entry is still current. The entries of content that is moved or removed, and of removed global assignment mappings, are removed from the index. Existing assignments can be indexed with ``updatePortletHashIndex()``.
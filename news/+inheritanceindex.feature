@@ -0,0 +1,4 @@
+Add ``IIndexedPortletManager``. Portlet managers marked with it keep a persistent index of the contextual assignments and blacklist statuses in effect at each location, so that retrieval does not need to visit every parent.
+Contextual assignment mappings now get their ``__parent__`` set to the content object they are stored on.
+The index is updated once for each change to a contextual assignment mapping, and only for the children whose entries change; editing an assignment does not update it.
+Content is located as it was adapted during the request, since the ``__parent__`` of a mapping is not acquisition wrapped. ``updateInheritedPortlets(root, manager, force=True)`` indexes existing content.
@@ -0,0 +1 @@
+``PortletAssignmentMapping`` now keeps its order in BTrees, giving each assignment a spaced-out rank, instead of a persistent list. Adding, removing and moving assignments only writes the ranks that change, so concurrent edits to the same portlet manager no longer conflict. Existing mappings are migrated when they are first changed, or by calling ``migrateOrder()``.
@@ -0,0 +1,2 @@
+``PortletManagerRenderer`` can update and render portlets whose renderer provides ``IThreadSafePortletRenderer`` concurrently in a thread pool, by setting ``parallel_rendering`` to True.
+Output is still joined in assignment order, and errors are handled by ``safe_render`` as before.
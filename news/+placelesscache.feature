@@ -0,0 +1,3 @@
+Add the optional ``IPlacelessPortletCache`` utility. It caches the user and group portlets of placeless portlet managers, such as dashboards, per principal.
+``PlacelessPortletCache`` keeps these entries in memory, up to a fixed maximum.
+Each global assignment mapping now has its own generation, so entries are only invalidated when the portlets of that user or one of their groups change.
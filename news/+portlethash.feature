@@ -0,0 +1,2 @@
+Portlet hashes are now kept in a bounded cache instead of being computed for every portlet shown. The new ``hashPortlet()`` function computes a hash without an info dict.
+Added ``IPortletManagerRenderer.portletByHash()``, which finds a shown portlet by its hash in an index of the portlets retrieved for the request. ``PortletFragment`` uses it.
@@ -0,0 +1,2 @@
+The default portlet retrievers and ``PortletManagerRenderer.portletsToShow()`` now return ``PortletInfo`` records, a ``dict`` subclass without an instance dictionary, so existing code using or modifying them keeps working.
+The record returned by ``portletsToShow()`` is shared with the renderer's ``__portlet_metadata__`` instead of being copied for every portlet, so the metadata now includes ``renderer`` and ``available``.
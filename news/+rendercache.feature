@@ -0,0 +1,3 @@
+Add an optional ``IPortletRenderCache`` utility, with in-memory and filesystem implementations, used by ``PortletManagerRenderer`` to cache the output of renderers providing ``ICacheablePortletRenderer``.
+Cached output is served without calling ``update()`` or ``render()``, and is no longer used once assignments of the portlet manager change.
+Expired files of the filesystem cache are removed when read, and by prune(), which is called periodically. Output rendered after assignments were changed in a transaction that may still be aborted is not stored.
@@ -0,0 +1,3 @@
+Portlet renderer factories are now cached by the interfaces provided by the context, request, view, manager and data provider.
+This avoids a five-way adapter lookup for each portlet.
+The cache is dropped when the adapter registry or the interface declarations change.
@@ -0,0 +1,3 @@
+Add an optional ``IPortletRetrieverCache`` utility that caches the assignments resolved by ``PortletRetriever``.
+Cache entries are invalidated through a per-storage generation counter, which is bumped whenever an assignment mapping or blacklist status changes.
+Entries are only used for the same context object and parents they were found for, so content re-created or moved in the place of other content does not see stale assignments, and nothing is stored while the generation has uncommitted changes.
@@ -0,0 +1,2 @@
+Add ``renderIter()`` to ``PortletManagerRenderer``. It yields the output of each portlet as soon as it is rendered, so that it can be streamed.
+Also add ``renderedPortlets()``, which yields the portlets to show along with their output, for templates.
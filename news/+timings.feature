@@ -0,0 +1,2 @@
+Add an optional ``IPortletTimingListener`` utility, to which ``PortletManagerRenderer`` reports the time spent on retrieval, filtering, availability checks, updating and rendering, per portlet manager and portlet hash.
+``plone.portlets.instrumentation.PortletTimingCollector`` aggregates these timings for exporters. Nothing is timed when no listener is registered.
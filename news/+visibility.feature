@@ -0,0 +1,2 @@
+Reading ``IPortletAssignmentSettings`` no longer stores an empty settings object on the assignment; settings are stored when first written.
+Assignment mappings now keep track of hidden assignments, so the retrievers can check visibility without loading the settings of every assignment.
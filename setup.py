@@ -58,7 +58,9 @@ setup(
         "zope.component",
         "zope.container",
         "zope.contentprovider",
+        "zope.globalrequest",
         "zope.interface",
+        "zope.lifecycleevent",
         "zope.location",
         "zope.publisher",
         "zope.schema",
@@ -0,0 +1,126 @@
+"""Request-scoped resolution of the portlet ancestry of a context.
+
+Retrieving contextual portlets means adapting the context and each of its
+parents to IPortletContext, ILocalPortletAssignable, IAnnotations and, for
+every portlet manager, ILocalPortletAssignmentManager. The results of these
+lookups do not change during a request, so they are computed once per
+context and shared by all portlet managers rendered for it.
+"""
+
+from plone.portlets.interfaces import ILocalPortletAssignable
+from plone.portlets.interfaces import ILocalPortletAssignmentManager
+from plone.portlets.interfaces import IPortletContext
+from zope.annotation.interfaces import IAnnotations
+from zope.component import getMultiAdapter
+from zope.component import queryAdapter
+from zope.globalrequest import getRequest
+
+ANCESTRY_KEY = "plone.portlets.ancestry"
+
+
+class PortletAncestor:
+    """A context in the portlet hierarchy, along with its adaptations.
+
+    ``assignable`` and ``annotations`` are None if the context does not
+    support local portlet assignments.
+    """
+
+    def __init__(self, context, pcontext):
+        self.context = context
+        self.pcontext = pcontext
+        self.uid = pcontext.uid
+
+        if ILocalPortletAssignable.providedBy(context):
+            self.assignable = context
+        else:
+            self.assignable = queryAdapter(context, ILocalPortletAssignable)
+
+        self.annotations = None
+        if self.assignable is not None:
+            if IAnnotations.providedBy(self.assignable):
+                self.annotations = self.assignable
+            else:
+                self.annotations = queryAdapter(self.assignable, IAnnotations)
+
+        self._assignmentManagers = {}
+
+    def assignmentManager(self, manager):
+        """Get the ILocalPortletAssignmentManager for the given portlet
+        manager, or None if this context is not assignable.
+        """
+        if self.assignable is None:
+            return None
+        manager_, lpam = self._assignmentManagers.get(id(manager), (None, None))
+        if manager_ is not manager:
+            lpam = getMultiAdapter(
+                (self.assignable, manager), ILocalPortletAssignmentManager
+            )
+            self._assignmentManagers[id(manager)] = (manager, lpam)
+        return lpam
+
+
+class PortletAncestry:
+    """The chain of PortletAncestors of a context, starting with the context
+    itself.
+
+    Parents are only resolved when iteration reaches them, so that a walk
+    which stops early, e.g. because parent portlets are blocked, does not
+    pay for the rest of the chain.
+    """
+
+    def __init__(self, context, pcontext=None):
+        self.context = context
+        if pcontext is None:
+            if IPortletContext.providedBy(context):
+                pcontext = context
+            else:
+                pcontext = queryAdapter(context, IPortletContext)
+        self._ancestors = []
+        self._next = (context, pcontext) if pcontext is not None else None
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index < len(self._ancestors):
+                yield self._ancestors[index]
+                index += 1
+            elif not self._resolveNext():
+                return
+
+    def _resolveNext(self):
+        if self._next is None:
+            return False
+        current, currentpc = self._next
+        self._ancestors.append(PortletAncestor(current, currentpc))
+
+        # Check the parent - if there is no parent, we will stop
+        self._next = None
+        parent = currentpc.getParent()
+        if parent is not None:
+            if IPortletContext.providedBy(parent):
+                parentpc = parent
+            else:
+                parentpc = queryAdapter(parent, IPortletContext)
+            if parentpc is not None:
+                self._next = (parent, parentpc)
+        return True
+
+
+def getPortletAncestry(context, pcontext=None):
+    """Get the PortletAncestry of the given context.
+
+    If there is a current request, the ancestry is stored on it, so that it
+    is only resolved once per context and request.
+    """
+    request = getRequest()
+    annotations = None
+    if request is not None:
+        annotations = queryAdapter(request, IAnnotations)
+    if annotations is None:
+        return PortletAncestry(context, pcontext)
+
+    ancestries = annotations.setdefault(ANCESTRY_KEY, {})
+    ancestry = ancestries.get(id(context), None)
+    if ancestry is None or ancestry.context is not context:
+        ancestry = ancestries[id(context)] = PortletAncestry(context, pcontext)
+    return ancestry
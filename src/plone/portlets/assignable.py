@@ -1,14 +1,20 @@
 from BTrees.OOBTree import OOBTree
 from persistent.mapping import PersistentMapping
+from plone.portlets.cache import bumpGeneration
 from plone.portlets.constants import CONTEXT_ASSIGNMENT_KEY
 from plone.portlets.constants import CONTEXT_BLACKLIST_STATUS_KEY
 from plone.portlets.constants import CONTEXT_CATEGORY
+from plone.portlets.inheritance import rememberLocation
+from plone.portlets.inheritance import setMappingParent
+from plone.portlets.inheritance import updateInheritedPortlets
 from plone.portlets.interfaces import IBlockingPortletManager
+from plone.portlets.interfaces import IIndexedPortletManager
 from plone.portlets.interfaces import ILocalPortletAssignable
 from plone.portlets.interfaces import ILocalPortletAssignmentManager
 from plone.portlets.interfaces import IPortletAssignmentMapping
 from plone.portlets.interfaces import IPortletManager
 from plone.portlets.storage import PortletAssignmentMapping
+from ZODB.POSException import ConflictError
 from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
 from zope.component import adapts
@@ -35,9 +41,89 @@ def localPortletAssignmentMappingAdapter(context, manager):
         portlets = local[manager.__name__] = PortletAssignmentMapping(
             manager=manager.__name__, category=CONTEXT_CATEGORY
         )
+    # Mappings stored by older versions have no __parent__ yet. This is
+    # written once, the first time such a mapping is adapted.
+    setMappingParent(portlets, context)
+    # Event handlers need the located content when the mapping changes.
+    rememberLocation(context)
     return portlets
 
 
+_missing = object()
+
+
+class BlacklistStatuses(PersistentMapping):
+    """The blacklist statuses set for a portlet manager at a given location,
+    mapping categories to True (blocked), False (shown) or None.
+
+    Concurrent changes to the statuses of different categories, or to the
+    same status for the same category, are resolved rather than raising a
+    ConflictError, so that blacklist statuses can be set in parallel.
+    """
+
+    def _p_resolveConflict(self, oldState, savedState, newState):
+        old = dict(oldState or {})
+        saved = dict(savedState or {})
+        new = dict(newState or {})
+        oldData = old.pop("data", {})
+        savedData = saved.pop("data", {})
+        newData = new.pop("data", {})
+        if old != saved or old != new:
+            raise ConflictError
+
+        resolved = dict(savedData)
+        for category in set(oldData) | set(newData):
+            oldValue = oldData.get(category, _missing)
+            newValue = newData.get(category, _missing)
+            if newValue is oldValue or newValue == oldValue:
+                continue
+            savedValue = savedData.get(category, _missing)
+            if savedValue is not oldValue and savedValue != oldValue:
+                # Both changed the status of this category
+                if savedValue != newValue:
+                    raise ConflictError
+                continue
+            if newValue is _missing:
+                del resolved[category]
+            else:
+                resolved[category] = newValue
+
+        saved["data"] = resolved
+        return saved
+
+
+def migrateBlacklist(context):
+    """Migrate the blacklist statuses stored on the given context by an older
+    version, in nested PersistentMappings, to the current format. Returns
+    True if anything was migrated.
+
+    Blacklists are also migrated when a blacklist status is next set.
+    """
+    if IAnnotations.providedBy(context):
+        annotations = context
+    else:
+        annotations = queryAdapter(context, IAnnotations)
+    if annotations is None:
+        return False
+    return _migrateBlacklist(annotations)
+
+
+def _migrateBlacklist(annotations):
+    local = annotations.get(CONTEXT_BLACKLIST_STATUS_KEY, None)
+    if local is None:
+        return False
+
+    migrated = False
+    if not isinstance(local, OOBTree):
+        local = annotations[CONTEXT_BLACKLIST_STATUS_KEY] = OOBTree(local)
+        migrated = True
+    for name, blacklist in list(local.items()):
+        if not isinstance(blacklist, BlacklistStatuses):
+            local[name] = BlacklistStatuses(blacklist)
+            migrated = True
+    return migrated
+
+
 @implementer(ILocalPortletAssignmentManager)
 class LocalPortletAssignmentManager:
     """Default implementation of ILocalPortletAssignmentManager which stores
@@ -53,6 +139,9 @@ class LocalPortletAssignmentManager:
     def setBlacklistStatus(self, category, status):
         blacklist = self._getBlacklist(True)
         blacklist[category] = status
+        bumpGeneration(self.manager)
+        if IIndexedPortletManager.providedBy(self.manager):
+            updateInheritedPortlets(self.context, self.manager)
 
     def getBlacklistStatus(self, category):
         blacklist = self._getBlacklist(False)
@@ -60,21 +149,33 @@ class LocalPortletAssignmentManager:
             return None
         return blacklist.get(category, None)
 
+    def getBlacklistStatuses(self):
+        blacklist = self._getBlacklist(False)
+        if blacklist is None:
+            return {}
+        return {
+            category: status
+            for category, status in blacklist.items()
+            if status is not None
+        }
+
     def _getBlacklist(self, create=False):
         if IAnnotations.providedBy(self.context):
             annotations = self.context
         else:
             annotations = queryAdapter(self.context, IAnnotations)
+        if create:
+            _migrateBlacklist(annotations)
         local = annotations.get(CONTEXT_BLACKLIST_STATUS_KEY, None)
         if local is None:
             if create:
-                local = annotations[CONTEXT_BLACKLIST_STATUS_KEY] = PersistentMapping()
+                local = annotations[CONTEXT_BLACKLIST_STATUS_KEY] = OOBTree()
             else:
                 return None
         blacklist = local.get(self.manager.__name__, None)
         if blacklist is None:
             if create:
-                blacklist = local[self.manager.__name__] = PersistentMapping()
+                blacklist = local[self.manager.__name__] = BlacklistStatuses()
             else:
                 return None
         return blacklist
@@ -92,3 +193,8 @@ class BlockingLocalPortletAssignmentManager(LocalPortletAssignmentManager):
         if category is CONTEXT_CATEGORY and value is None:
             return True
         return value
+
+    def getBlacklistStatuses(self):
+        statuses = super().getBlacklistStatuses()
+        statuses.setdefault(CONTEXT_CATEGORY, True)
+        return statuses
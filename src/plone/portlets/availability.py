@@ -0,0 +1,126 @@
+"""Declarative availability of portlets.
+
+Deciding whether a portlet is available usually means looking up its
+renderer and asking it. Portlets which are only shown e.g. for some content
+types, to authenticated users or during some time can declare so instead, by
+setting ``__portlet_availability__`` on the assignment or the data provider
+to a PortletAvailability (or any other IPortletAvailability)::
+
+    class Assignment(base.Assignment):
+        __portlet_availability__ = PortletAvailability(
+            portalTypes=("News Item",), authenticated=True
+        )
+
+The default portlet manager renderer checks the declaration before it looks
+up the renderer, and skips portlets which are not available.
+"""
+
+from datetime import datetime
+from functools import cached_property
+from plone.portlets.constants import CONTENT_TYPE_CATEGORY
+from plone.portlets.constants import USER_CATEGORY
+from plone.portlets.interfaces import IPortletAvailability
+from plone.portlets.interfaces import IPortletContext
+from zope.component import queryAdapter
+from zope.interface import implementer
+
+AVAILABILITY_ATTRIBUTE = "__portlet_availability__"
+
+
+class AvailabilityEnvironment:
+    """What the availability of portlets is decided on.
+
+    The portal type of the context and whether the current user is
+    authenticated are found in the global portlet categories of its
+    IPortletContext, the first time they are needed.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+    @cached_property
+    def _categories(self):
+        if IPortletContext.providedBy(self.context):
+            pcontext = self.context
+        else:
+            pcontext = queryAdapter(self.context, IPortletContext)
+        if pcontext is None:
+            return ()
+        return tuple(pcontext.globalPortletCategories(False))
+
+    @cached_property
+    def portalType(self):
+        """The content type of the context, or None if it is unknown."""
+        for category, key in self._categories:
+            if category == CONTENT_TYPE_CATEGORY:
+                return key
+        return None
+
+    @cached_property
+    def authenticated(self):
+        """Whether the current user is authenticated."""
+        for category, key in self._categories:
+            if category == USER_CATEGORY and key:
+                return True
+        return False
+
+
+@implementer(IPortletAvailability)
+class PortletAvailability:
+    """Declares when a portlet is available.
+
+    ``portalTypes`` is a collection of the content types the portlet is
+    shown for. If ``authenticated`` is True or False, the portlet is only
+    shown to authenticated or anonymous users, respectively. ``effective``
+    and ``expires`` are datetimes limiting when the portlet is shown; naive
+    ones are compared with the local time. Conditions which are None are not
+    checked.
+    """
+
+    def __init__(
+        self, portalTypes=None, authenticated=None, effective=None, expires=None
+    ):
+        if portalTypes is not None:
+            portalTypes = frozenset(portalTypes)
+        self.portalTypes = portalTypes
+        self.authenticated = authenticated
+        self.effective = effective
+        self.expires = expires
+
+    def isAvailable(self, environment):
+        if self.effective is not None:
+            if datetime.now(self.effective.tzinfo) < self.effective:
+                return False
+        if self.expires is not None:
+            if datetime.now(self.expires.tzinfo) >= self.expires:
+                return False
+        if self.authenticated is not None:
+            if environment.authenticated != bool(self.authenticated):
+                return False
+        if self.portalTypes is not None:
+            if environment.portalType not in self.portalTypes:
+                return False
+        return True
+
+
+def getAvailability(assignment):
+    """Get the IPortletAvailability declared by the given assignment or its
+    data provider, or None if there is none.
+    """
+    availability = getattr(assignment, AVAILABILITY_ATTRIBUTE, None)
+    if availability is None:
+        data = assignment.data
+        if data is not assignment:
+            availability = getattr(data, AVAILABILITY_ATTRIBUTE, None)
+    return availability
+
+
+def isPortletAvailable(assignment, environment):
+    """Check the availability declared by the given assignment in the given
+    AvailabilityEnvironment. Portlets which declare none are available.
+    """
+    availability = getAvailability(assignment)
+    if availability is None:
+        return True
+    return availability.isAvailable(environment)
@@ -0,0 +1,301 @@
+"""Benchmarks for portlet retrieval and rendering.
+
+This builds a synthetic, in-memory content hierarchy with portlets assigned
+at every level and to a number of groups, and times the default portlet
+retrievers and portlet manager renderer. Results are printed as JSON, so that
+they can be compared between versions::
+
+    python -m plone.portlets.benchmark --depth 10 --groups 50 > results.json
+
+The test dependencies of this package (see the ``test`` extra) need to be
+installed.
+"""
+
+from persistent import Persistent
+from plone.portlets.cache import PortletRetrieverCache
+from plone.portlets.constants import CONTEXT_CATEGORY
+from plone.portlets.constants import GROUP_CATEGORY
+from plone.portlets.constants import USER_CATEGORY
+from plone.portlets.interfaces import ILocalPortletAssignable
+from plone.portlets.interfaces import ILocalPortletAssignmentManager
+from plone.portlets.interfaces import IPlacelessPortletManager
+from plone.portlets.interfaces import IPortletAssignment
+from plone.portlets.interfaces import IPortletAssignmentMapping
+from plone.portlets.interfaces import IPortletContext
+from plone.portlets.interfaces import IPortletDataProvider
+from plone.portlets.interfaces import IPortletManager
+from plone.portlets.interfaces import IPortletRenderer
+from plone.portlets.interfaces import IPortletRetriever
+from plone.portlets.interfaces import IPortletRetrieverCache
+from plone.portlets.manager import PortletManager
+from plone.portlets.manager import PortletManagerRenderer
+from plone.portlets.storage import PortletAssignmentMapping
+from plone.portlets.storage import PortletCategoryMapping
+from zope.annotation.interfaces import IAttributeAnnotatable
+from zope.component import adapter
+from zope.component import getGlobalSiteManager
+from zope.component import getMultiAdapter
+from zope.container.contained import Contained
+from zope.interface import alsoProvides
+from zope.interface import implementer
+from zope.interface import Interface
+from zope.publisher.browser import BrowserView
+from zope.publisher.browser import TestRequest
+from zope.publisher.interfaces.browser import IBrowserRequest
+from zope.publisher.interfaces.browser import IBrowserView
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+
+@implementer(ILocalPortletAssignable)
+class Folder:
+    """A minimal content object."""
+
+    def __init__(self, name, parent=None):
+        self.__name__ = name
+        self.__parent__ = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+
+class Environment:
+    """The current user, as seen by the portlet context."""
+
+    userId = "user"
+    groupIds = ()
+
+
+@implementer(IPortletContext)
+@adapter(Folder)
+class FolderPortletContext:
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def uid(self):
+        names = []
+        obj = self.context
+        while obj is not None:
+            names.append(obj.__name__)
+            obj = obj.__parent__
+        return "/".join(reversed(names))
+
+    def getParent(self):
+        return self.context.__parent__
+
+    def globalPortletCategories(self, placeless=False):
+        categories = [(USER_CATEGORY, Environment.userId)]
+        categories.extend((GROUP_CATEGORY, g) for g in Environment.groupIds)
+        return categories
+
+
+@implementer(IPortletAssignment, IPortletDataProvider, IAttributeAnnotatable)
+class Assignment(Persistent, Contained):
+    available = True
+
+    def __init__(self, text):
+        self.text = text
+
+    @property
+    def data(self):
+        return self
+
+
+@implementer(IPortletRenderer)
+@adapter(Interface, IBrowserRequest, IBrowserView, IPortletManager, Assignment)
+class AssignmentRenderer:
+    available = True
+
+    def __init__(self, context, request, view, manager, data):
+        self.data = data
+
+    def update(self):
+        pass
+
+    def render(self):
+        return "<div>%s</div>" % self.data.text
+
+
+def buildTree(manager, depth, fanout, portlets, blockEvery=0):
+    """Build a content hierarchy of the given depth, with ``fanout``
+    children per folder, and ``portlets`` portlets assigned to ``manager``
+    in each folder. Contextual portlets are blocked at every ``blockEvery``
+    level, if given.
+
+    Returns the root and the deepest folder along the first branch.
+    """
+    root = Folder("")
+    level = [root]
+    for d in range(depth + 1):
+        for folder in level:
+            mapping = getMultiAdapter((folder, manager), IPortletAssignmentMapping)
+            for i in range(portlets):
+                mapping["portlet%d" % i] = Assignment("%s %d" % (folder.__name__, i))
+            if blockEvery and d and d % blockEvery == 0:
+                lpam = getMultiAdapter(
+                    (folder, manager), ILocalPortletAssignmentManager
+                )
+                lpam.setBlacklistStatus(CONTEXT_CATEGORY, True)
+        if d == depth:
+            break
+        level = [
+            Folder("folder%d" % i, parent) for parent in level for i in range(fanout)
+        ]
+    leaf = root
+    while leaf.children:
+        leaf = leaf.children[0]
+    return root, leaf
+
+
+def assignGlobal(manager, category, keys, portlets):
+    """Assign ``portlets`` portlets to each of the given keys."""
+    if category not in manager:
+        manager[category] = PortletCategoryMapping()
+    for key in keys:
+        mapping = manager[category][key] = PortletAssignmentMapping(
+            manager=manager.__name__, category=category
+        )
+        for i in range(portlets):
+            mapping["portlet%d" % i] = Assignment("%s %d" % (key, i))
+
+
+def timeit(func, repeat):
+    """Call func ``repeat`` times and return timing statistics in
+    milliseconds.
+    """
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings),
+    }
+
+
+def runBenchmarks(
+    depth=5,
+    fanout=2,
+    groups=10,
+    assignedGroups=2,
+    portlets=3,
+    blockEvery=0,
+    repeat=100,
+    cache=False,
+):
+    """Run the benchmarks with the given parameters and return the results
+    as a dict.
+
+    The component architecture must have been set up with the configuration
+    of this package, see plone.portlets.tests.configurationSetUp().
+    """
+    gsm = getGlobalSiteManager()
+    gsm.registerAdapter(FolderPortletContext)
+    gsm.registerAdapter(AssignmentRenderer)
+
+    manager = PortletManager()
+    gsm.registerUtility(manager, IPortletManager, name="benchmark")
+    placeless = PortletManager()
+    alsoProvides(placeless, IPlacelessPortletManager)
+    gsm.registerUtility(placeless, IPortletManager, name="benchmark.placeless")
+
+    retrieverCache = None
+    if cache:
+        retrieverCache = PortletRetrieverCache()
+        gsm.registerUtility(retrieverCache, IPortletRetrieverCache)
+
+    try:
+        Environment.groupIds = tuple("group%d" % i for i in range(groups))
+        root, leaf = buildTree(manager, depth, fanout, portlets, blockEvery)
+        for storage in (manager, placeless):
+            assignGlobal(storage, USER_CATEGORY, [Environment.userId], portlets)
+            assignGlobal(
+                storage, GROUP_CATEGORY, Environment.groupIds[:assignedGroups], portlets
+            )
+
+        def retrieve():
+            getMultiAdapter((leaf, manager), IPortletRetriever).getPortlets()
+
+        def retrievePlaceless():
+            getMultiAdapter((leaf, placeless), IPortletRetriever).getPortlets()
+
+        def lazyLoad():
+            request = TestRequest()
+            alsoProvides(request, IAttributeAnnotatable)
+            view = BrowserView(leaf, request)
+            renderer = PortletManagerRenderer(leaf, request, view, manager)
+            renderer._lazyLoadPortlets(manager)
+
+        return {
+            "parameters": {
+                "depth": depth,
+                "fanout": fanout,
+                "groups": groups,
+                "assignedGroups": assignedGroups,
+                "portlets": portlets,
+                "blockEvery": blockEvery,
+                "repeat": repeat,
+                "cache": cache,
+            },
+            "results": {
+                "PortletRetriever.getPortlets": timeit(retrieve, repeat),
+                "PlacelessPortletRetriever.getPortlets": timeit(
+                    retrievePlaceless, repeat
+                ),
+                "PortletManagerRenderer._lazyLoadPortlets": timeit(lazyLoad, repeat),
+            },
+        }
+    finally:
+        gsm.unregisterAdapter(FolderPortletContext)
+        gsm.unregisterAdapter(AssignmentRenderer)
+        gsm.unregisterUtility(manager, IPortletManager, name="benchmark")
+        gsm.unregisterUtility(placeless, IPortletManager, name="benchmark.placeless")
+        if retrieverCache is not None:
+            gsm.unregisterUtility(retrieverCache, IPortletRetrieverCache)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--fanout", type=int, default=2)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--assigned-groups", type=int, default=2)
+    parser.add_argument("--portlets", type=int, default=3)
+    parser.add_argument("--block-every", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    from plone.portlets.tests import configurationSetUp
+    from plone.portlets.tests import configurationTearDown
+
+    configurationSetUp()
+    try:
+        results = runBenchmarks(
+            depth=args.depth,
+            fanout=args.fanout,
+            groups=args.groups,
+            assignedGroups=args.assigned_groups,
+            portlets=args.portlets,
+            blockEvery=args.block_every,
+            repeat=args.repeat,
+            cache=args.cache,
+        )
+    finally:
+        configurationTearDown()
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
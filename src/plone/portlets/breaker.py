@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from plone.portlets.interfaces import IPortletCircuitBreaker
+from zope.interface import implementer
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger("portlets")
+
+
+@implementer(IPortletCircuitBreaker)
+class PortletCircuitBreaker:
+    """A process-local circuit breaker for slow portlets.
+
+    A portlet that takes longer than ``budget`` seconds to update and render
+    ``threshold`` times in a row is not rendered for ``cooldown`` seconds.
+    After that, it is rendered again; if it is still too slow, it is taken
+    out for another cool-down period right away.
+
+    The last good output of up to ``maxsize`` cacheable portlets is kept to
+    be shown in the meantime.
+    """
+
+    def __init__(self, budget=2.0, threshold=3, cooldown=60, maxsize=1000):
+        self.budget = budget
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._strikes = {}
+        self._openUntil = {}
+        self._outputs = OrderedDict()
+
+    def isOpen(self, hash):
+        with self._lock:
+            return self._openUntil.get(hash, 0) > time.time()
+
+    def record(self, hash, duration):
+        with self._lock:
+            if duration <= self.budget:
+                self._strikes.pop(hash, None)
+                self._openUntil.pop(hash, None)
+                return
+            # A portlet that was taken out before is taken out again after
+            # a single slow attempt.
+            if hash in self._openUntil:
+                strikes = self.threshold
+            else:
+                strikes = self._strikes.get(hash, 0) + 1
+            if strikes < self.threshold:
+                self._strikes[hash] = strikes
+                return
+            self._strikes.pop(hash, None)
+            self._openUntil[hash] = time.time() + self.cooldown
+        if isinstance(hash, bytes):
+            hash = hash.decode("ascii")
+        logger.warning(
+            "Portlet %s took %.2fs to render, not rendering it for %ss",
+            hash,
+            duration,
+            self.cooldown,
+        )
+
+    def storeOutput(self, key, output):
+        with self._lock:
+            self._outputs[key] = output
+            self._outputs.move_to_end(key)
+            while len(self._outputs) > self.maxsize:
+                self._outputs.popitem(last=False)
+
+    def lastOutput(self, key):
+        with self._lock:
+            return self._outputs.get(key, None)
@@ -0,0 +1,371 @@
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from collections import OrderedDict
+from plone.portlets.interfaces import IPlacelessPortletCache
+from plone.portlets.interfaces import IPortletRenderCache
+from plone.portlets.interfaces import IPortletRetrieverCache
+from plone.portlets.storage import _coerce
+from zope.component import getSiteManager
+from zope.interface import implementer
+from zope.interface import implementer_only
+from zope.interface import providedBy
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+_MISSING = object()
+
+
+def getGeneration(storage):
+    """Get the generation of the given portlet storage.
+
+    The generation is a counter that is bumped whenever an assignment mapping
+    or a blacklist status relevant to the storage changes. It is kept in a
+    persistent, conflict-resolving Length object, so that changes made by
+    other ZODB clients are seen as well.
+    """
+    counter = getattr(storage, "_portletsGeneration", None)
+    if counter is None:
+        return 0
+    return counter()
+
+
+def bumpGeneration(storage):
+    """Bump the generation of the given portlet storage, invalidating any
+    cached information derived from it.
+    """
+    counter = getattr(storage, "_portletsGeneration", None)
+    if counter is None:
+        counter = storage._portletsGeneration = Length()
+    counter.change(1)
+
+
+def isGenerationChanged(storage):
+    """Check whether the generation of the given portlet storage was changed
+    in the current transaction.
+
+    Until the transaction is committed, the change may still be aborted,
+    after which the same generation may be reached again by other changes.
+    Nothing derived from the storage must then be cached under it.
+    """
+    return _isChanged(storage, getattr(storage, "_portletsGeneration", None))
+
+
+def _isChanged(storage, counter):
+    if counter is None:
+        return False
+    if counter._p_changed:
+        return True
+    # A counter created in this transaction has not been stored yet.
+    return counter._p_oid is None and getattr(storage, "_p_jar", None) is not None
+
+
+def _generationKey(category, key):
+    """Get the key the generation of a global assignment mapping is kept
+    under, coercing the key as the category mapping does.
+    """
+    return (category, _coerce(key))
+
+
+def getKeyGenerations(storage, categories):
+    """Get the generations of the global assignment mappings for the given
+    (category, key) pairs in the given portlet storage, as a tuple.
+
+    Unlike the generation of the storage, these are only bumped when the
+    assignment mapping for that category and key changes, so that e.g. the
+    portlets of a user can be cached until that user's or one of their
+    groups' portlets change.
+    """
+    generations = getattr(storage, "_keyGenerations", None)
+    if generations is None:
+        return (0,) * len(categories)
+    result = []
+    for category, key in categories:
+        counter = generations.get(_generationKey(category, key), None)
+        result.append(0 if counter is None else counter())
+    return tuple(result)
+
+
+def bumpKeyGeneration(storage, category, key):
+    """Bump the generation of the global assignment mapping for the given
+    category and key in the given portlet storage.
+
+    Each generation is kept in its own conflict-resolving Length object, so
+    that concurrent changes to the same assignment mapping do not conflict.
+    """
+    generations = getattr(storage, "_keyGenerations", None)
+    if generations is None:
+        generations = storage._keyGenerations = OOBTree()
+    key = _generationKey(category, key)
+    counter = generations.get(key, None)
+    if counter is None:
+        generations[key] = Length(1)
+    else:
+        counter.change(1)
+
+
+# Bumped whenever a portlet type is registered, unregistered or changed in
+# this process.
+_portletTypesGeneration = 0
+_portletTypesLock = threading.Lock()
+
+
+def getPortletTypesGeneration():
+    """Get the generation of the portlet type registrations in this
+    process.
+    """
+    return _portletTypesGeneration
+
+
+def bumpPortletTypesGeneration():
+    """Bump the generation of the portlet type registrations, invalidating
+    the cached addable portlet types of all portlet managers.
+    """
+    global _portletTypesGeneration
+    with _portletTypesLock:
+        _portletTypesGeneration += 1
+
+
+class RendererFactoryCache:
+    """Portlet renderer factories resolved by an adapter registry, by the
+    interfaces provided by the (context, request, view, manager, data)
+    they are looked up for.
+
+    The cache is only used while the generation of the registry is the same,
+    which is bumped when the registry or one of its bases changes. Like the
+    lookup caches of the registry, it is cleared when the declarations of
+    the interfaces it has seen change.
+    """
+
+    maxsize = 1000
+
+    def __init__(self, registry):
+        self.generation = registry._generation
+        self._factories = {}
+
+    def lookup(self, registry, required, provided):
+        key = (required, provided)
+        factory = self._factories.get(key, _MISSING)
+        if factory is _MISSING:
+            factory = registry.lookup(required, provided)
+            if len(self._factories) >= self.maxsize:
+                self._factories.clear()
+            for spec in required:
+                spec.subscribe(self)
+            self._factories[key] = factory
+        return factory
+
+    def changed(self, originally_changed):
+        self._factories.clear()
+
+
+def lookupRendererFactory(objects, provided):
+    """Get the factory of the adapter of the given objects to the given
+    interface registered in the current site manager, or None if there is
+    none, using a RendererFactoryCache kept by the adapter registry.
+    """
+    registry = getSiteManager().adapters
+    cache = getattr(registry, "_v_portletRendererFactories", None)
+    if cache is None or cache.generation != registry._generation:
+        cache = RendererFactoryCache(registry)
+        registry._v_portletRendererFactories = cache
+    return cache.lookup(registry, tuple(map(providedBy, objects)), provided)
+
+
+@implementer(IPortletRetrieverCache)
+class PortletRetrieverCache:
+    """A bounded cache of resolved portlet assignments.
+
+    Entries are stored in a volatile attribute of the portlet storage. Since
+    persistent objects are specific to a ZODB connection, this ensures that
+    cached assignments are never shared between connections, and the cache
+    goes away when the storage is invalidated or removed from the connection
+    cache. Nothing is stored while the generation has uncommitted changes,
+    see isGenerationChanged().
+    """
+
+    attribute = "_v_portletRetrieverCache"
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+
+    def get(self, storage, key):
+        entries = getattr(storage, self.attribute, None)
+        if entries is None:
+            return None
+        current = self._generation(storage, key)
+        with self._lock:
+            entry = entries.get(key, None)
+            if entry is None:
+                return None
+            generation, value = entry
+            if generation != current:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+        return value
+
+    def set(self, storage, key, value):
+        if self._changed(storage, key):
+            return value
+        generation = self._generation(storage, key)
+        with self._lock:
+            entries = getattr(storage, self.attribute, None)
+            if entries is None:
+                entries = OrderedDict()
+                setattr(storage, self.attribute, entries)
+            entries[key] = (generation, value)
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        return value
+
+    def invalidate(self, storage):
+        with self._lock:
+            entries = getattr(storage, self.attribute, None)
+            if entries is not None:
+                entries.clear()
+
+    def _generation(self, storage, key):
+        return getGeneration(storage)
+
+    def _changed(self, storage, key):
+        return isGenerationChanged(storage)
+
+
+@implementer_only(IPlacelessPortletCache)
+class PlacelessPortletCache(PortletRetrieverCache):
+    """A bounded cache of the placeless portlets of principals.
+
+    Keys are the placeless global portlet categories of a principal, e.g.
+    their user id and groups. Like the PortletRetrieverCache, entries are
+    held in a volatile attribute of the portlet storage, but they are only
+    invalidated when the assignment mappings for these categories change.
+    """
+
+    attribute = "_v_placelessPortletCache"
+
+    def _generation(self, storage, key):
+        return getKeyGenerations(storage, key)
+
+
+@implementer(IPortletRenderCache)
+class RAMPortletRenderCache:
+    """A bounded in-memory cache of rendered portlet output.
+
+    Entries expire ``ttl`` seconds after they were stored. Since only
+    strings are stored, the cache can be shared between threads and ZODB
+    connections.
+    """
+
+    def __init__(self, maxsize=1000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@implementer(IPortletRenderCache)
+class FilesystemPortletRenderCache:
+    """A cache of rendered portlet output stored as files in a directory.
+
+    This allows the cache to be shared between processes on the same host,
+    and to survive restarts. Entries expire ``ttl`` seconds after they were
+    stored, according to the modification time of their file. Expired files
+    are removed when they are read, and by prune(), which set() calls at
+    most every ``ttl`` seconds.
+    """
+
+    suffix = ".portlet"
+    tmpSuffix = ".tmp"
+
+    def __init__(self, directory, ttl=300):
+        self.directory = directory
+        self.ttl = ttl
+        self._pruned = time.time()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                self._unlink(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        if self._pruned + self.ttl < time.time():
+            self.prune()
+        # Write to a temporary file first, so that readers never see
+        # partially written output.
+        fd, tmp = tempfile.mkstemp(suffix=self.tmpSuffix, dir=self.directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(value)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            self._unlink(tmp)
+        return value
+
+    def prune(self):
+        """Remove the files of expired entries, and temporary files left
+        behind by writers that did not finish.
+        """
+        self._pruned = now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith((self.suffix, self.tmpSuffix)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) + self.ttl < now:
+                    self._unlink(path)
+            except OSError:
+                pass
+
+    def invalidate(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                self._unlink(os.path.join(self.directory, name))
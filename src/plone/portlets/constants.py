@@ -3,6 +3,7 @@
 CONTEXT_ASSIGNMENT_KEY = "plone.portlets.contextassignments"
 CONTEXT_BLACKLIST_STATUS_KEY = "plone.portlets.categoryblackliststatus"
 ASSIGNMENT_SETTINGS_KEY = "plone.portlets.assignmentsettings"
+CONTEXT_INHERITED_KEY = "plone.portlets.inheritedassignments"
 
 # Portlet assignment categories
 
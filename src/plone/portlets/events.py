@@ -1,15 +1,43 @@
+from plone.portlets.cache import bumpGeneration
+from plone.portlets.cache import bumpKeyGeneration
+from plone.portlets.cache import bumpPortletTypesGeneration
+from plone.portlets.constants import CONTEXT_CATEGORY
+from plone.portlets.hashindex import indexAssignment
+from plone.portlets.hashindex import indexAssignmentMapping
+from plone.portlets.hashindex import unindexAssignment
+from plone.portlets.hashindex import unindexAssignmentMapping
+from plone.portlets.hashindex import unindexContext
+from plone.portlets.hashindex import updatePortletHashIndex
+from plone.portlets.inheritance import getInheritedPortlets
+from plone.portlets.inheritance import invalidateInheritedPortlets
+from plone.portlets.inheritance import locateMappingContext
+from plone.portlets.inheritance import updateInheritedPortlets
+from plone.portlets.interfaces import IHashIndexedPortletManager
+from plone.portlets.interfaces import IIndexedPortletManager
+from plone.portlets.interfaces import ILocalPortletAssignable
+from plone.portlets.interfaces import IPortletAssignment
+from plone.portlets.interfaces import IPortletAssignmentMapping
+from plone.portlets.interfaces import IPortletCategoryMapping
 from plone.portlets.interfaces import IPortletManager
 from plone.portlets.interfaces import IPortletManagerRenderer
+from plone.portlets.interfaces import IPortletStorage
+from plone.portlets.interfaces import IPortletType
+from zope.container.interfaces import IReadContainer
 from zope.interface import Interface
+from zope.interface.interfaces import IObjectEvent
 from zope.interface.interfaces import IRegistered
 from zope.interface.interfaces import IRegistrationEvent
 from zope.interface.interfaces import IUnregistered
 from zope.interface.interfaces import IUtilityRegistration
+from zope.lifecycleevent.interfaces import IObjectMovedEvent
 from zope.publisher.interfaces.browser import IBrowserRequest
 from zope.publisher.interfaces.browser import IBrowserView
 
+import logging
 import zope.component
 
+logger = logging.getLogger("portlets")
+
 
 @zope.component.adapter(IUtilityRegistration, IRegistrationEvent)
 def dispatchToComponent(registration, event):
@@ -53,3 +81,209 @@ def unregisterPortletManagerRenderer(manager, registration, event):
         provided=IPortletManagerRenderer,
         name=registration.name,
     )
+
+
+@zope.component.adapter(IPortletType, IUtilityRegistration, IRegistrationEvent)
+def portletTypeRegistrationChanged(portletType, registration, event):
+    """When a portlet type is registered or unregistered, invalidate the
+    addable portlet types cached by portlet managers.
+    """
+    bumpPortletTypesGeneration()
+
+
+def _findStorage(obj):
+    """Find the portlet storage an assignment mapping or category mapping
+    belongs to.
+
+    Contextual assignment mappings are not contained in a storage, so we
+    look up the portlet manager by the name recorded on the mapping.
+    """
+    name = getattr(obj, "__manager__", None)
+    if name:
+        return zope.component.queryUtility(IPortletManager, name=name)
+    while obj is not None:
+        if IPortletStorage.providedBy(obj):
+            return obj
+        obj = getattr(obj, "__parent__", None)
+    return None
+
+
+def _bumpGenerations(*containers):
+    """Bump the generation of the storages the given containers belong to."""
+    for container in {c for c in containers if c is not None}:
+        storage = _findStorage(container)
+        if storage is not None:
+            bumpGeneration(storage)
+
+
+def _updateInheritedPortlets(mapping):
+    """Update the inherited portlets index for the content the given
+    assignment mapping belongs to, if it is a contextual one, and for its
+    children as far as their entries change.
+    """
+    if getattr(mapping, "__category__", None) != CONTEXT_CATEGORY:
+        return
+    content = getattr(mapping, "__parent__", None)
+    storage = _findStorage(mapping)
+    if (
+        content is None
+        or storage is None
+        or not IIndexedPortletManager.providedBy(storage)
+    ):
+        return
+    context = locateMappingContext(mapping)
+    if context is None:
+        # Computing the entry from the unwrapped content would lose what
+        # it inherits. It is computed when needed instead.
+        logger.warning(
+            "Cannot locate %r to update its inherited portlets for %r; its "
+            "children need to be updated with updateInheritedPortlets().",
+            content,
+            storage.__name__,
+        )
+        invalidateInheritedPortlets(content, storage)
+        return
+    updateInheritedPortlets(context, storage)
+
+
+def _bumpKeyGeneration(categoryMapping, key, storage=None):
+    """Bump the generation of the global assignment mapping stored under the
+    given key in the given category mapping, if it is one.
+    """
+    if key is None or not IPortletCategoryMapping.providedBy(categoryMapping):
+        return
+    if storage is None:
+        storage = _findStorage(categoryMapping)
+    if storage is not None and categoryMapping.__name__ is not None:
+        bumpKeyGeneration(storage, categoryMapping.__name__, key)
+
+
+def _indexedStorage(container):
+    """Get the storage the given container belongs to if it keeps a hash
+    index, or None.
+    """
+    if container is None:
+        return None
+    storage = _findStorage(container)
+    if storage is None or not IHashIndexedPortletManager.providedBy(storage):
+        return None
+    return storage
+
+
+def _unlessBulkChange(container):
+    """Return the given container, or None if several assignments are being
+    added to or removed from it at once. The work is then done once, when
+    the container is notified of modification.
+    """
+    if getattr(container, "_v_bulkChange", None) is not None:
+        return None
+    return container
+
+
+def _eventContainers(obj, event):
+    if IObjectMovedEvent.providedBy(event):
+        return (event.oldParent, event.newParent)
+    return (obj,)
+
+
+@zope.component.adapter(IPortletAssignment, IObjectEvent)
+def assignmentChanged(assignment, event):
+    """When an assignment is added, removed, moved or modified, bump the
+    generation of the storage it belongs to.
+
+    The inherited portlets index is updated when the assignment mapping is
+    notified of the modification, see assignmentMappingChanged(). Changes to
+    the assignment itself do not change which assignments are inherited.
+    """
+    if IObjectMovedEvent.providedBy(event):
+        oldParent = _unlessBulkChange(event.oldParent)
+        newParent = _unlessBulkChange(event.newParent)
+        _bumpGenerations(oldParent, newParent)
+        for mapping in {m for m in (oldParent, newParent) if m is not None}:
+            _bumpKeyGeneration(mapping.__parent__, mapping.__name__)
+        storage = _indexedStorage(oldParent)
+        if storage is not None:
+            unindexAssignment(storage, oldParent, event.oldName)
+        storage = _indexedStorage(newParent)
+        if storage is not None:
+            indexAssignment(storage, assignment)
+    else:
+        mapping = assignment.__parent__
+        _bumpGenerations(mapping)
+        if mapping is not None:
+            _bumpKeyGeneration(mapping.__parent__, mapping.__name__)
+
+
+@zope.component.adapter(IPortletAssignmentMapping, IObjectEvent)
+def assignmentMappingChanged(mapping, event):
+    """When an assignment mapping is modified or re-ordered, or added to or
+    removed from a category mapping, bump the generation of the storage it
+    belongs to, and update the inherited portlets index.
+    """
+    _bumpGenerations(*_eventContainers(mapping, event))
+    if IObjectMovedEvent.providedBy(event):
+        _bumpKeyGeneration(event.oldParent, event.oldName)
+        _bumpKeyGeneration(event.newParent, event.newName)
+        storage = _indexedStorage(event.oldParent)
+        if storage is not None:
+            unindexAssignmentMapping(
+                storage, mapping, (event.oldParent.__name__, event.oldName)
+            )
+        if event.newParent is not None:
+            storage = _indexedStorage(mapping)
+            if storage is not None:
+                indexAssignmentMapping(storage, mapping)
+    else:
+        _updateInheritedPortlets(mapping)
+        _bumpKeyGeneration(mapping.__parent__, mapping.__name__)
+        removed = getattr(mapping, "_v_bulkChange", None)
+        storage = _indexedStorage(mapping)
+        if removed is not None and storage is not None:
+            for name in removed:
+                unindexAssignment(storage, mapping, name)
+            indexAssignmentMapping(storage, mapping)
+
+
+@zope.component.adapter(IPortletCategoryMapping, IObjectEvent)
+def categoryMappingChanged(mapping, event):
+    """When a category mapping is added to or removed from a storage, bump
+    the generation of that storage, and of the assignment mappings it
+    contains.
+    """
+    _bumpGenerations(*_eventContainers(mapping, event))
+    if IObjectMovedEvent.providedBy(event):
+        for storage, category in (
+            (event.oldParent, event.oldName),
+            (event.newParent, event.newName),
+        ):
+            if IPortletStorage.providedBy(storage) and category is not None:
+                for key in mapping.keys():
+                    bumpKeyGeneration(storage, category, key)
+
+
+@zope.component.adapter(ILocalPortletAssignable, IObjectMovedEvent)
+def assignableMoved(obj, event):
+    """When content is added or moved, update the inherited portlets index
+    and the portlet hash index for it and its children. When it is removed,
+    remove its assignments and those of its children from the portlet hash
+    index.
+
+    The event is also dispatched to the children of the moved object; those
+    are covered by the recursive update and are ignored here.
+    """
+    if event.object is not obj:
+        return
+    for name, manager in zope.component.getUtilitiesFor(IPortletManager):
+        if IHashIndexedPortletManager.providedBy(manager):
+            if event.newParent is None:
+                unindexContext(manager, obj)
+            else:
+                # Entries for the old location are removed as well.
+                updatePortletHashIndex(manager, obj)
+        if event.newParent is None or not IIndexedPortletManager.providedBy(manager):
+            continue
+        if IReadContainer.providedBy(obj) or (
+            getInheritedPortlets(obj, manager) is not None
+        ):
+            # The uids of the moved content and its children changed.
+            updateInheritedPortlets(obj, manager, force=True)
@@ -0,0 +1,52 @@
+from plone.portlets.interfaces import IPortletManager
+from plone.portlets.interfaces import IPortletManagerRenderer
+from plone.portlets.interfaces import IPortletRenderCache
+from plone.portlets.utils import unhashPortletInfo
+from zope.component import queryMultiAdapter
+from zope.component import queryUtility
+from zope.publisher.browser import BrowserView
+
+import binascii
+
+
+class PortletFragment(BrowserView):
+    """Render a single portlet of the context, e.g. one that was deferred by
+    the portlet manager renderer.
+
+    The portlet is identified by the hash in the ``portlethash`` request
+    parameter. Only portlets that the portlet manager renderer would show
+    for the context and current request are rendered, so that the hash
+    cannot be used to reveal other portlets.
+
+    This view is not registered by default. Applications wanting deferred
+    rendering should register it for their content and layer, with
+    appropriate permissions, and load it from the placeholders rendered in
+    place of deferred portlets.
+    """
+
+    def __call__(self):
+        hash = self.request.form.get("portlethash", "")
+        try:
+            info = unhashPortletInfo(hash)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return ""
+
+        manager = queryUtility(IPortletManager, name=info["manager"])
+        if manager is None:
+            return ""
+
+        managerRenderer = queryMultiAdapter(
+            (self.context, self.request, self, manager), IPortletManagerRenderer
+        )
+        if managerRenderer is None:
+            return ""
+        managerRenderer.deferred_rendering = False
+
+        portlet = managerRenderer.portletByHash(hash)
+        if portlet is None:
+            return ""
+        renderer = portlet["renderer"]
+        cache = queryUtility(IPortletRenderCache)
+        if cache is None or not managerRenderer._getCachedOutput(cache, renderer):
+            renderer.update()
+        return managerRenderer.safe_render(renderer)
@@ -0,0 +1,287 @@
+"""A persistent index of portlet assignments by portlet hash.
+
+Portlets are identified in pages by a hash of their manager, category, key
+and name (see plone.portlets.utils.hashPortletInfo). Finding the assignment
+for such a hash means looking up the portlet manager, then the category
+mapping or the content object the portlet was assigned to, and finally the
+assignment.
+
+Portlet managers providing IHashIndexedPortletManager keep a BTree mapping
+the hashes of their assignments to the assignments themselves, so that a
+single portlet, e.g. one that is re-rendered or edited on its own, is found
+with one lookup. The index is kept up to date by event handlers, including
+when content is moved or removed. Entries are also checked against the
+assignment when they are looked up, so that entries left behind are not
+used.
+"""
+
+from BTrees.OOBTree import OOBTree
+from plone.portlets.constants import CONTEXT_ASSIGNMENT_KEY
+from plone.portlets.constants import CONTEXT_CATEGORY
+from plone.portlets.inheritance import locateMappingContext
+from plone.portlets.inheritance import setMappingParent
+from plone.portlets.interfaces import IPortletContext
+from plone.portlets.interfaces import IPortletManager
+from plone.portlets.utils import hashPortlet
+from plone.portlets.utils import unhashPortletInfo
+from zope.annotation.interfaces import IAnnotations
+from zope.component import queryAdapter
+from zope.component import queryUtility
+from zope.container.interfaces import IReadContainer
+
+import binascii
+
+
+def getPortletHashIndex(storage, create=False):
+    """Get the hash index of the given portlet storage, a BTree mapping
+    portlet hashes to assignments.
+
+    Returns None if the storage has no index yet, unless ``create`` is True.
+    """
+    index = getattr(storage, "_portletHashIndex", None)
+    if index is None and create:
+        index = storage._portletHashIndex = OOBTree()
+    return index
+
+
+def _mappingKey(mapping, context=None):
+    """Get the category and key of the given assignment mapping, or
+    (None, None) if it is not stored anywhere.
+
+    The key of a contextual assignment mapping is the uid of its content,
+    which is the given context, or located as described in
+    plone.portlets.inheritance.locateMappingContext().
+    """
+    category = getattr(mapping, "__category__", None)
+    if category == CONTEXT_CATEGORY:
+        if context is None and getattr(mapping, "__parent__", None) is not None:
+            context = locateMappingContext(mapping)
+        if context is None:
+            return None, None
+        if IPortletContext.providedBy(context):
+            pcontext = context
+        else:
+            pcontext = queryAdapter(context, IPortletContext)
+        if pcontext is None:
+            return None, None
+        return category, pcontext.uid
+
+    parent = getattr(mapping, "__parent__", None)
+    if not category and parent is not None:
+        category = parent.__name__
+    if not category or not mapping.__name__:
+        return None, None
+    return category, mapping.__name__
+
+
+def _indexedKey(mapping):
+    """Get the category and key the assignments of the given assignment
+    mapping are indexed under.
+
+    Contextual assignment mappings remember the key they were indexed
+    under, so that their entries can be found again after their content
+    was moved or removed, and without locating the content.
+    """
+    if getattr(mapping, "__category__", None) == CONTEXT_CATEGORY:
+        key = getattr(mapping, "_portletHashKey", None)
+        if key is not None:
+            return key
+    return _mappingKey(mapping)
+
+
+def _rememberKey(mapping, key):
+    """Remember the key the assignments of the given contextual assignment
+    mapping are indexed under. This is only written when it changes.
+    """
+    if key[0] == CONTEXT_CATEGORY and (
+        getattr(mapping, "_portletHashKey", None) != key
+    ):
+        mapping._portletHashKey = key
+
+
+def _portletHash(storage, key, name):
+    category, key = key
+    if category is None:
+        return None
+    return hashPortlet(storage.__name__, category, key, str(name))
+
+
+def indexAssignment(storage, assignment):
+    """Add the given assignment to the hash index of the given storage.
+
+    Returns the hash, or None if the assignment could not be indexed.
+    """
+    mapping = assignment.__parent__
+    if mapping is None:
+        return None
+    key = _indexedKey(mapping)
+    hash = _portletHash(storage, key, assignment.__name__)
+    if hash is not None:
+        _rememberKey(mapping, key)
+        index = getPortletHashIndex(storage, create=True)
+        if index.get(hash, None) is not assignment:
+            index[hash] = assignment
+    return hash
+
+
+def unindexAssignment(storage, mapping, name):
+    """Remove the assignment stored in the given assignment mapping under
+    the given name from the hash index of the given storage.
+    """
+    index = getPortletHashIndex(storage)
+    if index is None:
+        return
+    hash = _portletHash(storage, _indexedKey(mapping), name)
+    if hash is not None and hash in index:
+        del index[hash]
+
+
+def indexAssignmentMapping(storage, mapping, context=None):
+    """Add all assignments of the given assignment mapping to the hash index
+    of the given storage.
+
+    For contextual assignment mappings, the content may be given. If it was
+    moved since the mapping was indexed, the entries for its old location
+    are removed.
+    """
+    if getattr(mapping, "__category__", None) == CONTEXT_CATEGORY:
+        key = _mappingKey(mapping, context)
+        if key[0] is None:
+            return
+        indexed = getattr(mapping, "_portletHashKey", None)
+        if indexed is not None and indexed != key:
+            unindexAssignmentMapping(storage, mapping, indexed)
+        _rememberKey(mapping, key)
+    for assignment in mapping.values():
+        indexAssignment(storage, assignment)
+
+
+def unindexAssignmentMapping(storage, mapping, key=None):
+    """Remove the assignments of the given assignment mapping from the hash
+    index of the given storage.
+
+    ``key`` is the (category, key) pair they were indexed under, by default
+    the one of the mapping. Entries are only removed if they are for the
+    assignments of this mapping, so that those of other content that took
+    the place of its content are kept.
+    """
+    index = getPortletHashIndex(storage)
+    if index is None:
+        return
+    if key is None:
+        key = _indexedKey(mapping)
+    for name, assignment in mapping.items():
+        hash = _portletHash(storage, key, name)
+        if hash is not None and index.get(hash, None) is assignment:
+            del index[hash]
+
+
+def _isCurrent(assignment, info):
+    """Check that the given assignment is still stored where the given
+    portlet info says.
+    """
+    mapping = getattr(assignment, "__parent__", None)
+    if mapping is None or assignment.__name__ != info["name"]:
+        return False
+    try:
+        if mapping.get(info["name"], None) is not assignment:
+            return False
+    except (AttributeError, TypeError):
+        return False
+    # Contextual assignments move along with their content, which changes
+    # their key.
+    return _indexedKey(mapping) == (info["category"], info["key"])
+
+
+def lookupAssignment(hash):
+    """Get the portlet assignment with the given hash, or None if it cannot
+    be found.
+
+    The hash index of the portlet manager is used if it has one. Otherwise,
+    global (non-contextual) assignments are looked up in the storage.
+    Contextual assignments can only be found through the index.
+
+    Note that this does not check whether the portlet would be shown to the
+    current user; callers rendering or editing the portlet must do so.
+    """
+    if isinstance(hash, str):
+        try:
+            hash = hash.encode("ascii")
+        except UnicodeEncodeError:
+            return None
+    try:
+        info = unhashPortletInfo(hash)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+    manager = queryUtility(IPortletManager, name=info["manager"])
+    if manager is None:
+        return None
+
+    index = getPortletHashIndex(manager)
+    if index is not None:
+        assignment = index.get(hash, None)
+        if assignment is not None and _isCurrent(assignment, info):
+            return assignment
+
+    if info["category"] == CONTEXT_CATEGORY:
+        return None
+    categoryMapping = manager.get(info["category"], None)
+    if categoryMapping is None:
+        return None
+    mapping = categoryMapping.get(info["key"], None)
+    if mapping is None:
+        return None
+    return mapping.get(info["name"], None)
+
+
+def updatePortletHashIndex(storage, context=None):
+    """Index the assignments of the given storage.
+
+    Global assignments are indexed if no context is given. Otherwise, the
+    contextual assignments of the context and its children (found if it is
+    an IReadContainer) are indexed. Call this without a context and with the
+    site root to index the portlets of an existing site. This also sets the
+    missing __parent__ of contextual assignment mappings stored by older
+    versions.
+    """
+    if context is None:
+        for categoryMapping in storage.values():
+            for mapping in categoryMapping.values():
+                indexAssignmentMapping(storage, mapping)
+        return
+
+    for content, mapping in _contextualMappings(storage, context):
+        # Mappings stored by older versions need to know their content to
+        # be indexed.
+        setMappingParent(mapping, content)
+        indexAssignmentMapping(storage, mapping, content)
+
+
+def unindexContext(storage, context):
+    """Remove the contextual assignments of the given context and its
+    children (found if it is an IReadContainer) from the hash index of the
+    given storage, e.g. when the context is removed.
+    """
+    for content, mapping in _contextualMappings(storage, context):
+        unindexAssignmentMapping(storage, mapping)
+
+
+def _contextualMappings(storage, context):
+    """Yield (content, mapping) tuples for the contextual assignment mappings
+    of the given storage stored on the given context and its children.
+    """
+    if IAnnotations.providedBy(context):
+        annotations = context
+    else:
+        annotations = queryAdapter(context, IAnnotations)
+    if annotations is not None:
+        local = annotations.get(CONTEXT_ASSIGNMENT_KEY, None)
+        if local is not None:
+            mapping = local.get(storage.__name__, None)
+            if mapping is not None:
+                yield context, mapping
+
+    if IReadContainer.providedBy(context):
+        for child in context.values():
+            yield from _contextualMappings(storage, child)
@@ -0,0 +1,26 @@
+class PortletInfo(dict):
+    """Information about a portlet, as returned by
+    IPortletRetriever.getPortlets() and
+    IPortletManagerRenderer.portletsToShow().
+
+    This is a dict, so that code written for the dicts returned by older
+    versions keeps working, including code which modifies them. It has no
+    instance dictionary of its own, so it costs no more than a plain dict.
+    Fields which have not been set are not present as keys.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def fromMapping(cls, mapping, **fields):
+        """Create a PortletInfo from the given mapping (e.g. a dict returned
+        by a custom IPortletRetriever), updated with the given fields.
+        """
+        info = cls(mapping)
+        if fields:
+            info.update(fields)
+        return info
+
+    def replace(self, **fields):
+        """Return a new PortletInfo with the given fields changed."""
+        return self.fromMapping(self, **fields)
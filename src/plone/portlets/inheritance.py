@@ -0,0 +1,284 @@
+"""A persistent index of inherited contextual portlets.
+
+For portlet managers providing IIndexedPortletManager, each indexed
+ILocalPortletAssignable stores the contextual assignments and blacklist
+statuses in effect at that location, i.e. its own ones combined with those
+inherited from its parents. The default IPortletRetriever can then read a
+single annotation instead of visiting every parent.
+"""
+
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from plone.portlets.constants import CONTEXT_ASSIGNMENT_KEY
+from plone.portlets.constants import CONTEXT_CATEGORY
+from plone.portlets.constants import CONTEXT_INHERITED_KEY
+from plone.portlets.interfaces import ILocalPortletAssignable
+from plone.portlets.interfaces import ILocalPortletAssignmentManager
+from plone.portlets.interfaces import IPortletContext
+from zope.annotation.interfaces import IAnnotations
+from zope.component import getMultiAdapter
+from zope.component import queryAdapter
+from zope.container.interfaces import IReadContainer
+from zope.globalrequest import getRequest
+
+LOCATIONS_KEY = "plone.portlets.locations"
+
+
+class InheritedPortlets(Persistent):
+    """The contextual portlets and blacklist statuses in effect at a given
+    location, for a given portlet manager.
+
+    ``assignments`` is a tuple of (key, assignment) pairs, where the key is
+    the uid of the portlet context the assignment was made at, in the order
+    the default retriever returns them. ``blacklist`` maps global categories
+    to their effective blacklist status.
+    """
+
+    def __init__(self, assignments=(), blacklist=None):
+        self.assignments = tuple(assignments)
+        self.blacklist = dict(blacklist or {})
+
+    def __eq__(self, other):
+        if not isinstance(other, InheritedPortlets):
+            return NotImplemented
+        return (
+            self.assignments == other.assignments and self.blacklist == other.blacklist
+        )
+
+    __hash__ = Persistent.__hash__
+
+
+def _assignable(context):
+    if ILocalPortletAssignable.providedBy(context):
+        return context
+    return queryAdapter(context, ILocalPortletAssignable)
+
+
+def _annotations(assignable):
+    if IAnnotations.providedBy(assignable):
+        return assignable
+    return queryAdapter(assignable, IAnnotations)
+
+
+def _portletContext(context):
+    if IPortletContext.providedBy(context):
+        return context
+    return queryAdapter(context, IPortletContext)
+
+
+def setMappingParent(mapping, context):
+    """Set the given content object as the __parent__ of the given contextual
+    assignment mapping, if it has none.
+
+    Contextual assignment mappings stored by older versions have no
+    __parent__, so the content they belong to, and the indexes to update
+    when they change, cannot be found. Returns True if the mapping was
+    changed.
+    """
+    if mapping is None or getattr(mapping, "__parent__", None) is not None:
+        return False
+    # Unwrap acquisition wrappers, if any, before storing the reference.
+    mapping.__parent__ = getattr(context, "aq_base", context)
+    return True
+
+
+def rememberLocation(context):
+    """Remember the given content object on the current request, in the
+    (e.g. acquisition-wrapped) form it was given in, so that
+    locateMappingContext() can find it.
+    """
+    base = getattr(context, "aq_base", context)
+    if base is context:
+        return
+    request = getRequest()
+    if request is None:
+        return
+    annotations = queryAdapter(request, IAnnotations)
+    if annotations is not None:
+        annotations.setdefault(LOCATIONS_KEY, {})[id(base)] = (base, context)
+
+
+def locateMappingContext(mapping):
+    """Get the content object the given contextual assignment mapping belongs
+    to, in a form that knows its location, or None if it cannot be located.
+
+    The __parent__ of a mapping refers to its content without acquisition
+    wrappers. Content which relies on acquisition to find its parents and
+    path (e.g. in Zope 2) is therefore located through the acquisition
+    parent of the mapping if it is wrapped, or as it was adapted to
+    IPortletAssignmentMapping during the current request.
+    """
+    content = getattr(mapping, "__parent__", None)
+    if content is None:
+        return None
+    parent = getattr(mapping, "aq_parent", None)
+    if parent is not None and getattr(parent, "aq_base", parent) is content:
+        return parent
+    if not hasattr(content, "__of__"):
+        return content
+    request = getRequest()
+    if request is None:
+        return None
+    annotations = queryAdapter(request, IAnnotations)
+    if annotations is None:
+        return None
+    base, context = annotations.get(LOCATIONS_KEY, {}).get(id(content), (None, None))
+    if base is not content:
+        return None
+    return context
+
+
+def getInheritedPortlets(context, manager):
+    """Get the InheritedPortlets stored for the given context and manager,
+    or None if the context has not been indexed.
+
+    This never writes to the database.
+    """
+    assignable = _assignable(context)
+    if assignable is None:
+        return None
+    annotations = _annotations(assignable)
+    if annotations is None:
+        return None
+    index = annotations.get(CONTEXT_INHERITED_KEY, None)
+    if index is None:
+        return None
+    return index.get(manager.__name__, None)
+
+
+def findInheritedPortlets(context, manager):
+    """Get the stored InheritedPortlets in effect at the given context.
+
+    If the context is not an ILocalPortletAssignable, its parents are
+    searched for the nearest one. Returns None if that one has not been
+    indexed.
+    """
+    current = context
+    while current is not None:
+        if _assignable(current) is not None:
+            return getInheritedPortlets(current, manager)
+        pcontext = _portletContext(current)
+        if pcontext is None:
+            return None
+        current = pcontext.getParent()
+    return InheritedPortlets()
+
+
+def computeInheritedPortlets(context, manager):
+    """Compute the InheritedPortlets in effect at the given context, using
+    the index of the parent where possible.
+
+    Returns None if the context is not an ILocalPortletAssignable.
+    """
+    assignable = _assignable(context)
+    pcontext = _portletContext(context)
+    if assignable is None or pcontext is None:
+        return None
+
+    annotations = _annotations(assignable)
+    name = manager.__name__
+
+    own = []
+    local = annotations.get(CONTEXT_ASSIGNMENT_KEY, None)
+    if local is not None:
+        mapping = local.get(name, None)
+        if mapping is not None:
+            # Assignments being removed are still in the mapping when the
+            # removal event is handled, but no longer have a name.
+            own = [
+                (pcontext.uid, a)
+                for a in mapping.values()
+                if getattr(a, "__name__", None) is not None
+            ]
+
+    lpam = getMultiAdapter((assignable, manager), ILocalPortletAssignmentManager)
+    statuses = lpam.getBlacklistStatuses()
+    parentsBlocked = statuses.get(CONTEXT_CATEGORY, None)
+
+    inherited = lookupInheritedPortlets(pcontext.getParent(), manager)
+
+    assignments = list(own)
+    if not parentsBlocked:
+        assignments.extend(inherited.assignments)
+
+    blacklist = dict(inherited.blacklist)
+    for category, status in statuses.items():
+        if category != CONTEXT_CATEGORY:
+            blacklist[category] = status
+
+    return InheritedPortlets(assignments, blacklist)
+
+
+def lookupInheritedPortlets(context, manager):
+    """Get the InheritedPortlets in effect at the given context.
+
+    The index is used where possible. Otherwise, the InheritedPortlets are
+    computed, but not stored.
+    """
+    if context is None:
+        return InheritedPortlets()
+    inherited = findInheritedPortlets(context, manager)
+    if inherited is not None:
+        return inherited
+    current = context
+    while current is not None:
+        inherited = computeInheritedPortlets(current, manager)
+        if inherited is not None:
+            return inherited
+        pcontext = _portletContext(current)
+        if pcontext is None:
+            break
+        current = pcontext.getParent()
+    return InheritedPortlets()
+
+
+def invalidateInheritedPortlets(context, manager):
+    """Remove the InheritedPortlets stored for the given context and manager,
+    so that they are computed when needed. Its children are not changed.
+    """
+    assignable = _assignable(context)
+    if assignable is None:
+        return
+    annotations = _annotations(assignable)
+    index = annotations.get(CONTEXT_INHERITED_KEY, None)
+    if index is not None and manager.__name__ in index:
+        del index[manager.__name__]
+
+
+def updateInheritedPortlets(context, manager, recursive=True, force=False):
+    """Re-compute and store the InheritedPortlets for the given context and
+    manager.
+
+    If ``recursive`` is True, children of the context (found if it is an
+    IReadContainer) are updated as well, as far as the InheritedPortlets of
+    their parents changed. If ``force`` is True, the whole subtree is
+    updated, e.g. after it was moved; call this on the site root to index
+    existing content. Both load the content they update.
+
+    Contextual assignment mappings stored by older versions are given a
+    __parent__, so that later changes to them update the index.
+    """
+    assignable = _assignable(context)
+    if assignable is not None:
+        annotations = _annotations(assignable)
+        local = annotations.get(CONTEXT_ASSIGNMENT_KEY, None)
+        if local is not None:
+            setMappingParent(local.get(manager.__name__, None), assignable)
+
+    # Content that is not assignable has no entry; its children inherit
+    # from its parents.
+    changed = True
+    inherited = computeInheritedPortlets(context, manager)
+    if inherited is not None:
+        changed = False
+        index = annotations.get(CONTEXT_INHERITED_KEY, None)
+        if index is None:
+            index = annotations[CONTEXT_INHERITED_KEY] = OOBTree()
+        existing = index.get(manager.__name__, None)
+        if existing is None or existing != inherited:
+            index[manager.__name__] = inherited
+            changed = True
+
+    if recursive and (changed or force) and IReadContainer.providedBy(context):
+        for child in context.values():
+            updateInheritedPortlets(child, manager, recursive=True, force=force)
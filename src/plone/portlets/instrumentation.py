@@ -0,0 +1,74 @@
+"""Timing of portlet retrieval and rendering.
+
+If an IPortletTimingListener utility is registered, the default
+IPortletManagerRenderer reports how long each phase of finding and rendering
+portlets took. When no listener is registered, nothing is timed.
+"""
+
+from plone.portlets.interfaces import IPortletTimingListener
+from zope.interface import implementer
+
+import threading
+import time
+
+
+def timed(listener, manager, phase, hash, func):
+    """Call func and report its duration to the given listener, if any.
+
+    The duration is reported even if func raises an exception.
+    """
+    if listener is None:
+        return func()
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        listener.portletTiming(manager, phase, hash, time.perf_counter() - start)
+
+
+async def timedAsync(listener, manager, phase, hash, func):
+    """Await the coroutine returned by func and report its duration to the
+    given listener, like timed().
+    """
+    if listener is None:
+        return await func()
+    start = time.perf_counter()
+    try:
+        return await func()
+    finally:
+        listener.portletTiming(manager, phase, hash, time.perf_counter() - start)
+
+
+@implementer(IPortletTimingListener)
+class PortletTimingCollector:
+    """A listener aggregating the reported timings in memory.
+
+    An exporter (e.g. for statsd or Prometheus) can periodically call
+    collect() to fetch and reset the aggregated timings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+
+    def portletTiming(self, manager, phase, hash, duration):
+        key = (manager, phase, hash)
+        with self._lock:
+            count, total, maximum = self._timings.get(key, (0, 0.0, 0.0))
+            self._timings[key] = (
+                count + 1,
+                total + duration,
+                max(maximum, duration),
+            )
+
+    def collect(self):
+        """Return the timings aggregated since the last call, as a dict
+        mapping (manager, phase, hash) tuples to dicts with the keys
+        'count', 'total' and 'max' (in seconds).
+        """
+        with self._lock:
+            timings, self._timings = self._timings, {}
+        return {
+            key: {"count": count, "total": total, "max": maximum}
+            for key, (count, total, maximum) in timings.items()
+        }
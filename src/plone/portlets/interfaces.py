@@ -151,6 +151,26 @@ class IPortletAssignment(IContained, IAttributeAnnotatable):
     data = Attribute("Portlet data object")
 
 
+class IPortletAvailability(Interface):
+    """A declaration of when a portlet is available.
+
+    Portlet assignments, or their data providers, may declare when they are
+    available by setting ``__portlet_availability__`` to an object providing
+    this interface. It is checked by the default IPortletManagerRenderer
+    before the renderer of the portlet is looked up, so that portlets which
+    are not available cost little more than the check. See
+    plone.portlets.availability.PortletAvailability.
+    """
+
+    def isAvailable(environment):
+        """Return True if the portlet is available in the given
+        environment, a plone.portlets.availability.AvailabilityEnvironment
+        describing the context and the current user.
+
+        This should be cheap and must not depend on the renderer.
+        """
+
+
 # A content provider capable of rendering portlets - each type of portlet will
 # need one of these
 
@@ -182,6 +202,66 @@ class IPortletRenderer(IContentProvider):
     )
 
 
+class ICacheablePortletRenderer(IPortletRenderer):
+    """A portlet renderer whose output may be cached.
+
+    If an IPortletRenderCache utility is registered, the default
+    IPortletManagerRenderer will cache the output of renderers providing this
+    interface, and serve it without calling update() or render() again.
+
+    By default, the output is cached per portlet assignment and context. A
+    renderer may define a cacheKey() method to vary the output further.
+    """
+
+    def cacheKey():
+        """Return a hashable value identifying the variant of the output
+        to cache, e.g. the roles of the current user, or None if the output
+        should not be cached at this time.
+
+        This method is optional.
+        """
+
+
+class IThreadSafePortletRenderer(IPortletRenderer):
+    """A portlet renderer which may be updated and rendered in a thread
+    other than the one handling the request.
+
+    If parallel rendering is enabled on the default IPortletManagerRenderer,
+    renderers providing this interface are updated and rendered concurrently.
+    They should not access persistent objects, since ZODB connections must
+    not be shared between threads. The current request and site are
+    available as usual.
+    """
+
+
+class IAsyncPortletRenderer(IPortletRenderer):
+    """A portlet renderer which can be updated and rendered asynchronously,
+    e.g. because it awaits I/O.
+
+    When the default IPortletManagerRenderer is updated and rendered with
+    updateAsync() and renderAsync(), these methods are awaited concurrently
+    for all such renderers. The synchronous update() and render() methods
+    must still be provided, for when the portlet manager is rendered
+    synchronously.
+    """
+
+    def updateAsync():
+        """Coroutine updating the portlet, like update()."""
+
+    def renderAsync():
+        """Coroutine returning the rendered portlet, like render()."""
+
+
+class IDeferredPortletRenderer(IPortletRenderer):
+    """A portlet renderer whose rendering may be deferred.
+
+    If deferred rendering is enabled on the default IPortletManagerRenderer,
+    renderers providing this interface are replaced by a placeholder, and
+    can be rendered separately, e.g. by a PortletFragment view requested
+    by the browser once the page has loaded.
+    """
+
+
 # Discovery of portlets
 
 
@@ -199,8 +279,85 @@ class IPortletRetriever(Interface):
         assignment object; 'category', containing the category the
         assignment came from; 'key', being the key within this category; and
         'name' being the name of the assignment.
+
+        The default retrievers return plone.portlets.info.PortletInfo
+        records, which are such dicts.
+        """
+
+
+class IPortletBatchRetriever(Interface):
+    """A component capable of discovering the portlets for several portlet
+    managers at once.
+
+    Typically, a content object will be adapted to IPortletBatchRetriever.
+    The default implementation walks the content hierarchy once for all
+    portlet managers, rather than once per manager.
+    """
+
+    def getPortlets(managers):
+        """Return the portlets to be rendered in each of the given
+        IPortletManagers.
+
+        Returns a dict mapping the name of each manager to a list as returned
+        by IPortletRetriever.getPortlets().
+        """
+
+
+class IPortletRetrieverCache(Interface):
+    """A cache of resolved portlet assignments.
+
+    If a utility providing this interface is registered, the default
+    IPortletRetriever will consult it before walking the content hierarchy.
+    No such utility is registered by default.
+
+    Entries are held per portlet storage and are invalidated whenever the
+    generation of that storage changes, i.e. whenever an assignment mapping
+    or blacklist status relevant to it is modified. Implementations must not
+    store entries while the generation has uncommitted changes, see
+    plone.portlets.cache.isGenerationChanged().
+    """
+
+    def get(storage, key):
+        """Return the cached value for the given key, or None if there is
+        no valid entry for it.
+        """
+
+    def set(storage, key, value):
+        """Cache the given value under the given key and return it."""
+
+    def invalidate(storage):
+        """Discard all entries held for the given storage."""
+
+
+class IPlacelessPortletCache(Interface):
+    """A cache of the placeless portlets of principals.
+
+    If a utility providing this interface is registered, the default
+    IPortletRetriever for placeless portlet managers (e.g. dashboards) will
+    consult it before looking up the user and group assignments. No such
+    utility is registered by default.
+
+    Keys are the placeless global portlet categories of the principal, as
+    returned by IPortletContext.globalPortletCategories(True), as a tuple of
+    tuples. Entries are invalidated when the assignment mapping for any of
+    these categories changes, see plone.portlets.cache.getKeyGenerations().
+
+    Values hold persistent assignments, so implementations must not share
+    them between ZODB connections. Since they are computed while viewing,
+    they should not be stored in the database either.
+    """
+
+    def get(storage, key):
+        """Return the cached value for the given key, or None if there is
+        no valid entry for it.
         """
 
+    def set(storage, key, value):
+        """Cache the given value under the given key and return it."""
+
+    def invalidate(storage):
+        """Discard all entries held for the given storage."""
+
 
 # Portlet management
 
@@ -228,6 +385,15 @@ class IPortletCategoryMapping(IContainer, IContained):
 
     contains("plone.portlets.interfaces.IPortletAssignmentMapping")
 
+    def assignedKeys():
+        """Get a set-like object with the keys that have at least one
+        portlet assigned.
+
+        This allows the assignments for many keys (e.g. all groups of a user)
+        to be looked up without probing each key. Returns None if no such
+        summary is available, in which case each key has to be checked.
+        """
+
 
 class IPortletAssignmentMapping(
     IOrderedContainer, IContainerNamesContainer, IContained
@@ -279,6 +445,15 @@ class ILocalPortletAssignmentManager(Interface):
         not inherited, and will default to None if not set.
         """
 
+    def getBlacklistStatuses():
+        """Get the blacklisting status of all categories that have one set
+        in the current context.
+
+        Returns a dict mapping categories to True or False. Categories with
+        a status of None are omitted. As with getBlacklistStatus(), the
+        statuses are not inherited.
+        """
+
 
 class IPortletManager(IPortletStorage, IContained):
     """A manager for portlets.
@@ -316,6 +491,32 @@ class IBlockingPortletManager(IPortletManager):
     """
 
 
+class IIndexedPortletManager(IPortletManager):
+    """A marker interface for portlet managers which keep a persistent index
+    of inherited contextual portlets.
+
+    For each ILocalPortletAssignable that has been indexed, the contextual
+    assignments and blacklist statuses in effect there (including those
+    inherited from parents) are stored in an annotation. The index is
+    updated whenever assignments or blacklist statuses change, so that the
+    default IPortletRetriever does not need to visit every parent.
+
+    Existing content can be indexed with
+    plone.portlets.inheritance.updateInheritedPortlets().
+    """
+
+
+class IHashIndexedPortletManager(IPortletManager):
+    """A marker interface for portlet managers which keep a persistent index
+    of their assignments by portlet hash, see plone.portlets.hashindex.
+
+    The index is updated whenever assignments are added or removed, and
+    when content with contextual assignments is moved or removed. Existing
+    assignments can be indexed with
+    plone.portlets.hashindex.updatePortletHashIndex().
+    """
+
+
 class IPlacelessPortletManager(IPortletManager):
     """A marker interface for managers for placeless portlets.
 
@@ -358,6 +559,41 @@ class IPortletManagerRenderer(IContentProvider):
         containing the appropriate IPortletRenderer.
         """
 
+    def updateAsync():
+        """Coroutine updating the portlets to show, like update().
+
+        Renderers providing IAsyncPortletRenderer are awaited, and those
+        providing IThreadSafePortletRenderer are run in a thread pool,
+        concurrently. Other renderers are updated in the calling thread.
+        """
+
+    def renderAsync():
+        """Coroutine rendering the portlets to show, like render(), but
+        rendering them concurrently where possible as for updateAsync().
+        """
+
+    def renderIter():
+        """Render the portlets to show incrementally, like render().
+
+        Returns an iterator yielding the output of each portlet, and the
+        newlines between them, as soon as it is rendered, so that the
+        output can be streamed. Joined, the chunks are the output of
+        render(). If a template is set, its output is the only chunk.
+        """
+
+    def renderedPortlets():
+        """Render the portlets to show one by one using safe_render().
+
+        Returns an iterator yielding the items of portletsToShow() with the
+        additional key 'output', for templates which wrap the output of each
+        portlet and are rendered incrementally.
+        """
+
+    def portletByHash(hash):
+        """Get the portlet with the given hash, as found in the list
+        returned by portletsToShow(), or None if it is not shown.
+        """
+
     def safe_render(portlet_renderer):
         """Render a portlet in such a way that exceptions are not
         raised but rather logged and an error is shown in place of the
@@ -365,6 +601,83 @@ class IPortletManagerRenderer(IContentProvider):
         """
 
 
+class IPortletRenderCache(Interface):
+    """A cache of rendered portlet output.
+
+    If a utility providing this interface is registered, the default
+    IPortletManagerRenderer will use it for renderers providing
+    ICacheablePortletRenderer. No such utility is registered by default.
+
+    Keys include the generation of the portlet manager, so that entries are
+    no longer used once assignments change. Output is not stored while the
+    generation has uncommitted changes.
+    """
+
+    def get(key):
+        """Return the cached output for the given key, or None if there is
+        no valid entry for it.
+        """
+
+    def set(key, value):
+        """Cache the given output under the given key and return it."""
+
+    def invalidate():
+        """Discard all entries."""
+
+
+class IPortletTimingListener(Interface):
+    """A listener for timings of portlet retrieval and rendering.
+
+    If a utility providing this interface is registered, the default
+    IPortletManagerRenderer reports the duration of each phase to it. No
+    such utility is registered by default, in which case nothing is timed.
+    """
+
+    def portletTiming(manager, phase, hash, duration):
+        """Record a timing.
+
+        ``manager`` is the name of the portlet manager. ``phase`` is one of
+        'retrieval' (finding the assignments of the manager), 'filter'
+        (checking the availability of the assignments), 'availability'
+        (checking the availability of a renderer), 'update' or 'render'.
+        ``hash`` is the portlet hash (see plone.portlets.utils) for the
+        per-portlet phases, and None for the others. ``duration`` is in
+        seconds.
+
+        This may be called from several threads at once.
+        """
+
+
+class IPortletCircuitBreaker(Interface):
+    """Tracks portlets which are repeatedly slow to render.
+
+    If a utility providing this interface is registered, the default
+    IPortletManagerRenderer reports the time taken to update and render each
+    portlet to it. While the breaker is open for a portlet, the portlet is
+    neither updated nor rendered. Instead, its last good output is shown if
+    its renderer provides ICacheablePortletRenderer, or the error message
+    otherwise. No such utility is registered by default.
+    """
+
+    def isOpen(hash):
+        """Return True if the portlet with the given hash should not be
+        rendered at this time.
+        """
+
+    def record(hash, duration):
+        """Record the time in seconds it took to update and render the
+        portlet with the given hash.
+        """
+
+    def storeOutput(key, output):
+        """Remember the good output of a cacheable portlet under the given
+        key, as used for the IPortletRenderCache.
+        """
+
+    def lastOutput(key):
+        """Get the output remembered under the given key, or None."""
+
+
 class IPortletAssignmentSettings(Interface):
     """Adapts IPortletAssignment to return additional settings for a portlet assignment.
 
@@ -1,26 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from plone.memoize.view import memoize
+from plone.portlets.availability import AvailabilityEnvironment
+from plone.portlets.availability import isPortletAvailable
+from plone.portlets.cache import getGeneration
+from plone.portlets.cache import getPortletTypesGeneration
+from plone.portlets.cache import isGenerationChanged
+from plone.portlets.cache import lookupRendererFactory
+from plone.portlets.info import PortletInfo
+from plone.portlets.instrumentation import timed
+from plone.portlets.instrumentation import timedAsync
+from plone.portlets.interfaces import IAsyncPortletRenderer
+from plone.portlets.interfaces import ICacheablePortletRenderer
+from plone.portlets.interfaces import IDeferredPortletRenderer
+from plone.portlets.interfaces import IPlacelessPortletManager
+from plone.portlets.interfaces import IPortletBatchRetriever
+from plone.portlets.interfaces import IPortletCircuitBreaker
+from plone.portlets.interfaces import IPortletContext
 from plone.portlets.interfaces import IPortletManager
 from plone.portlets.interfaces import IPortletManagerRenderer
+from plone.portlets.interfaces import IPortletRenderCache
 from plone.portlets.interfaces import IPortletRenderer
 from plone.portlets.interfaces import IPortletRetriever
+from plone.portlets.interfaces import IPortletTimingListener
 from plone.portlets.interfaces import IPortletType
+from plone.portlets.interfaces import IThreadSafePortletRenderer
 from plone.portlets.storage import PortletStorage
-from plone.portlets.utils import hashPortletInfo
+from plone.portlets.utils import hashPortlet
 from ZODB.POSException import ConflictError
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapter
 from zope.component import getMultiAdapter
+from zope.component import getSiteManager
 from zope.component import getUtilitiesFor
-from zope.component import queryMultiAdapter
+from zope.component import queryAdapter
+from zope.component import queryUtility
+from zope.component.hooks import getSite
+from zope.component.hooks import setSite
 from zope.contentprovider.interfaces import UpdateNotCalled
+from zope.globalrequest import clearRequest
+from zope.globalrequest import getRequest
+from zope.globalrequest import setRequest
 from zope.interface import implementer
 from zope.interface import Interface
+from zope.interface import providedBy
 from zope.publisher.interfaces.browser import IBrowserRequest
 from zope.publisher.interfaces.browser import IBrowserView
 
+import asyncio
 import logging
+import threading
+import time
 
 logger = logging.getLogger("portlets")
 
+BATCH_RETRIEVAL_KEY = "plone.portlets.batchretrieval"
+
+
+_executors = {}
+_executorsLock = threading.Lock()
+
+
+def _getExecutor(workers):
+    """Get the process-wide thread pool with the given number of workers
+    used for parallel rendering.
+    """
+    with _executorsLock:
+        executor = _executors.get(workers, None)
+        if executor is None:
+            executor = _executors[workers] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="portlets"
+            )
+        return executor
+
 
 @implementer(IPortletManagerRenderer)
 @adapter(Interface, IBrowserRequest, IBrowserView, IPortletManager)
@@ -36,12 +88,34 @@ class PortletManagerRenderer:
     template = None
     error_message = None
 
+    # If True, renderers providing IThreadSafePortletRenderer are updated
+    # and rendered concurrently in a pool of this many threads, while the
+    # others are rendered in the request thread.
+    parallel_rendering = False
+    parallel_workers = 4
+
+    # If True, renderers providing IDeferredPortletRenderer are neither
+    # updated nor rendered, but replaced by a placeholder, see
+    # deferredPlaceholder().
+    deferred_rendering = False
+
+    # If True, the portlets of all (non-placeless) portlet managers are
+    # retrieved at once, using an IPortletBatchRetriever, the first time
+    # any of them is rendered during a request.
+    batch_retrieval = False
+
     def __init__(self, context, request, view, manager):
         self.__parent__ = view
         self.manager = manager  # part of interface
         self.context = context
         self.request = request
         self.__updated = False
+        self._renderCacheKeys = {}
+        self._cachedOutput = {}
+        self._renderFutures = {}
+        self._degraded = set()
+        self._durations = {}
+        self._utilities = None
 
     @property
     def visible(self):
@@ -70,30 +144,394 @@ class PortletManagerRenderer:
     def allPortlets(self):
         return self._lazyLoadPortlets(self.manager)
 
+    def portletByHash(self, hash):
+        if isinstance(hash, str):
+            try:
+                hash = hash.encode("ascii")
+            except UnicodeEncodeError:
+                return None
+        portlet = self._portletsByHash(self.manager).get(hash, None)
+        if portlet is None or not portlet["available"]:
+            return None
+        return portlet
+
     def update(self):
+        futures = []
+        for renderer, update in self._prepareUpdates():
+            if self._renderInParallel(renderer):
+                futures.append(self._submit(update))
+            else:
+                update()
+        for future in futures:
+            future.result()
+
+    async def updateAsync(self):
+        pending = []
+        for renderer, update in self._prepareUpdates():
+            if IAsyncPortletRenderer.providedBy(renderer):
+                pending.append(
+                    self._awaitTimed(renderer, "update", renderer.updateAsync)
+                )
+            elif IThreadSafePortletRenderer.providedBy(renderer):
+                pending.append(asyncio.wrap_future(self._submit(update)))
+            else:
+                update()
+        await asyncio.gather(*pending)
+
+    def _prepareUpdates(self):
+        """Yield (renderer, update) tuples for the portlets which need to be
+        updated, where update is a function updating the renderer and
+        reporting the time taken. Deferred portlets, portlets found in the
+        IPortletRenderCache and those whose IPortletCircuitBreaker is open
+        are skipped.
+        """
         self.__updated = True
+        cache, listener, breaker = self._getUtilities()
         for p in self.portletsToShow():
-            p["renderer"].update()
+            renderer = p["renderer"]
+            if self._isDeferred(renderer):
+                continue
+            if cache is not None and self._getCachedOutput(cache, renderer):
+                continue
+            if breaker is not None and breaker.isOpen(p["hash"]):
+                self._degraded.add(id(renderer))
+                continue
+            update = renderer.update
+            if listener is not None:
+                update = partial(
+                    timed, listener, self.manager.__name__, "update", p["hash"], update
+                )
+            if breaker is not None:
+                update = partial(self._measure, renderer, update)
+            yield renderer, update
+
+    def _getUtilities(self):
+        """Get the IPortletRenderCache, IPortletTimingListener and
+        IPortletCircuitBreaker utilities, or None for those which are not
+        registered. They are looked up once for each portlet manager
+        renderer, rather than for each portlet.
+        """
+        if self._utilities is None:
+            self._utilities = (
+                queryUtility(IPortletRenderCache),
+                queryUtility(IPortletTimingListener),
+                queryUtility(IPortletCircuitBreaker),
+            )
+        return self._utilities
 
     def render(self):
         if not self.__updated:
             raise UpdateNotCalled
 
         portlets = self.portletsToShow()
+        self._startRendering(portlets)
+        return self._renderPortlets(portlets)
+
+    def renderIter(self):
+        if not self.__updated:
+            raise UpdateNotCalled
+
+        portlets = self.portletsToShow()
+        self._startRendering(portlets)
+        if self.template:
+            return iter([self.template(portlets=portlets)])
+        return self._iterPortlets(portlets)
+
+    def renderedPortlets(self):
+        if not self.__updated:
+            raise UpdateNotCalled
+
+        portlets = self.portletsToShow()
+        self._startRendering(portlets)
+        return (
+            PortletInfo.fromMapping(p, output=self.safe_render(p["renderer"]))
+            for p in portlets
+        )
+
+    def _startRendering(self, portlets):
+        """Start rendering the given portlets in the thread pool if parallel
+        rendering is enabled.
+        """
+        for renderer in self._renderersToRender(portlets):
+            if self._renderInParallel(renderer):
+                self._renderFutures[id(renderer)] = self._submit(
+                    self._timedRender(renderer)
+                )
+
+    def _iterPortlets(self, portlets):
+        for i, p in enumerate(portlets):
+            if i:
+                yield "\n"
+            yield self._renderPortlet(p["renderer"])
+
+    async def renderAsync(self):
+        if not self.__updated:
+            raise UpdateNotCalled
+
+        # Render what can be rendered concurrently up front. Failures are
+        # raised when the output is used, as for parallel rendering.
+        portlets = self.portletsToShow()
+        pending = []
+        for renderer in self._renderersToRender(portlets):
+            if IAsyncPortletRenderer.providedBy(renderer):
+                future = asyncio.ensure_future(
+                    self._awaitTimed(renderer, "render", renderer.renderAsync)
+                )
+            elif IThreadSafePortletRenderer.providedBy(renderer):
+                future = asyncio.wrap_future(self._submit(self._timedRender(renderer)))
+            else:
+                continue
+            self._renderFutures[id(renderer)] = future
+            pending.append(future)
+        await asyncio.gather(*pending, return_exceptions=True)
+        return self._renderPortlets(portlets)
+
+    def _renderersToRender(self, portlets):
+        """Get the renderers of the given portlets which need rendering,
+        i.e. are not deferred, cached, degraded or being rendered already.
+        """
+        for p in portlets:
+            renderer = p["renderer"]
+            if (
+                id(renderer) not in self._cachedOutput
+                and id(renderer) not in self._degraded
+                and id(renderer) not in self._renderFutures
+                and not self._isDeferred(renderer)
+            ):
+                yield renderer
+
+    def _renderPortlets(self, portlets):
         if self.template:
             return self.template(portlets=portlets)
         else:
-            return "\n".join([p["renderer"].render() for p in portlets])
+            return "".join(self._iterPortlets(portlets))
 
     def safe_render(self, portlet_renderer):
         try:
-            return portlet_renderer.render()
+            return self._renderPortlet(portlet_renderer)
         except ConflictError:
             raise
         except Exception:
             logger.exception(f"Error while rendering {self!r}")
             return self.error_message()
 
+    def deferredPlaceholder(self, renderer):
+        """Get the markup to render in place of a deferred portlet.
+
+        The placeholder carries the hash of the portlet, which can be passed
+        to a plone.portlets.fragment.PortletFragment view to render the
+        portlet itself.
+        """
+        hash = renderer.__portlet_metadata__["hash"]
+        if isinstance(hash, bytes):
+            hash = hash.decode("ascii")
+        return '<div class="portletDeferred" data-portlethash="%s"></div>' % hash
+
+    def _isDeferred(self, renderer):
+        return self.deferred_rendering and IDeferredPortletRenderer.providedBy(renderer)
+
+    def _renderCacheKey(self, renderer):
+        """Get the key to cache the output of the given renderer under in
+        the IPortletRenderCache, or None if it should not be cached.
+        """
+        if not ICacheablePortletRenderer.providedBy(renderer):
+            return None
+        metadata = getattr(renderer, "__portlet_metadata__", None)
+        if metadata is None:
+            return None
+        variant = None
+        cacheKey = getattr(renderer, "cacheKey", None)
+        if cacheKey is not None:
+            variant = cacheKey()
+            if variant is None:
+                return None
+        if IPortletContext.providedBy(self.context):
+            pcontext = self.context
+        else:
+            pcontext = queryAdapter(self.context, IPortletContext)
+        uid = pcontext.uid if pcontext is not None else None
+        return (metadata["hash"], uid, getGeneration(self.manager), variant)
+
+    def _getCachedOutput(self, cache, renderer):
+        """Look up the output of the given renderer in the given cache, and
+        remember it for render(). Returns True if it was found.
+        """
+        key = self._renderCacheKey(renderer)
+        if key is None:
+            return False
+        self._renderCacheKeys[id(renderer)] = key
+        output = cache.get(key)
+        if output is None:
+            return False
+        self._cachedOutput[id(renderer)] = output
+        return True
+
+    def _renderPortlet(self, renderer):
+        """Render the given portlet renderer, using output found in the
+        IPortletRenderCache during update() where possible. Deferred
+        portlets are rendered as a placeholder.
+        """
+        if self._isDeferred(renderer):
+            return self.deferredPlaceholder(renderer)
+        output = self._cachedOutput.get(id(renderer), None)
+        if output is not None:
+            return output
+        cache, listener, breaker = self._getUtilities()
+        if id(renderer) in self._degraded:
+            return self._degradedOutput(breaker, renderer)
+
+        future = self._renderFutures.pop(id(renderer), None)
+        try:
+            if future is not None:
+                output = future.result()
+            else:
+                output = self._timedRender(renderer)()
+        finally:
+            if breaker is not None:
+                metadata = getattr(renderer, "__portlet_metadata__", {})
+                breaker.record(
+                    metadata.get("hash", None),
+                    self._durations.pop(id(renderer), 0.0),
+                )
+
+        # Output rendered after the generation was changed in this
+        # transaction is not stored, as the change may still be aborted.
+        if isGenerationChanged(self.manager):
+            return output
+        key = self._renderCacheKeys.get(id(renderer), None)
+        if key is not None and cache is not None:
+            cache.set(key, output)
+        if breaker is not None:
+            if key is None:
+                key = self._renderCacheKey(renderer)
+            if key is not None:
+                breaker.storeOutput(key, output)
+        return output
+
+    def _degradedOutput(self, breaker, renderer):
+        """Get the output for a portlet which is not rendered because its
+        IPortletCircuitBreaker is open: its last good output if it is
+        cacheable, or the error message otherwise.
+        """
+        key = self._renderCacheKey(renderer)
+        if key is not None:
+            output = breaker.lastOutput(key)
+            if output is not None:
+                return output
+        if self.error_message is None:
+            return ""
+        return self.error_message()
+
+    def _measure(self, renderer, func):
+        """Call func, adding the time taken to the duration recorded for
+        the given renderer.
+        """
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            duration = time.perf_counter() - start
+            self._durations[id(renderer)] = (
+                self._durations.get(id(renderer), 0.0) + duration
+            )
+
+    async def _awaitTimed(self, renderer, phase, func):
+        """Await the coroutine returned by func, reporting the time taken
+        to the IPortletTimingListener and IPortletCircuitBreaker if there
+        are any.
+        """
+        cache, listener, breaker = self._getUtilities()
+        metadata = getattr(renderer, "__portlet_metadata__", {})
+        start = time.perf_counter()
+        try:
+            return await timedAsync(
+                listener,
+                self.manager.__name__,
+                phase,
+                metadata.get("hash", None),
+                func,
+            )
+        finally:
+            if breaker is not None:
+                duration = time.perf_counter() - start
+                self._durations[id(renderer)] = (
+                    self._durations.get(id(renderer), 0.0) + duration
+                )
+
+    def _timedRender(self, renderer):
+        """Get a function rendering the given renderer, reporting the time
+        taken to the IPortletTimingListener and IPortletCircuitBreaker if
+        there are any.
+        """
+        cache, listener, breaker = self._getUtilities()
+        render = renderer.render
+        if listener is not None:
+            metadata = getattr(renderer, "__portlet_metadata__", {})
+            render = partial(
+                timed,
+                listener,
+                self.manager.__name__,
+                "render",
+                metadata.get("hash", None),
+                render,
+            )
+        if breaker is not None:
+            render = partial(self._measure, renderer, render)
+        return render
+
+    def _renderInParallel(self, renderer):
+        return self.parallel_rendering and IThreadSafePortletRenderer.providedBy(
+            renderer
+        )
+
+    def _submit(self, func):
+        """Call the given function in the rendering thread pool, with the
+        current request and site set up as in this thread.
+        """
+        request = getRequest()
+        site = getSite()
+
+        def call():
+            setRequest(request)
+            setSite(site)
+            try:
+                return func()
+            finally:
+                setSite(None)
+                clearRequest()
+
+        return _getExecutor(self.parallel_workers).submit(call)
+
+    def _retrievePortlets(self, manager):
+        """Get the portlets assigned to the given manager, as returned by
+        IPortletRetriever.getPortlets().
+
+        If batch retrieval is enabled, the portlets for all portlet managers
+        are looked up at once and shared with other portlet manager
+        renderers for the same context during the request.
+        """
+        if self.batch_retrieval and not IPlacelessPortletManager.providedBy(manager):
+            annotations = queryAdapter(self.request, IAnnotations)
+            if annotations is not None:
+                batches = annotations.setdefault(BATCH_RETRIEVAL_KEY, {})
+                context, portlets = batches.get(id(self.context), (None, None))
+                if context is not self.context or manager.__name__ not in portlets:
+                    managers = [
+                        m
+                        for name, m in getUtilitiesFor(IPortletManager)
+                        if not IPlacelessPortletManager.providedBy(m)
+                    ]
+                    if manager not in managers:
+                        managers.append(manager)
+                    batch = IPortletBatchRetriever(self.context)
+                    portlets = batch.getPortlets(managers)
+                    batches[id(self.context)] = (self.context, portlets)
+                # The renderer builds new records from these, so only the
+                # list needs copying
+                return list(portlets[manager.__name__])
+        retriever = getMultiAdapter((self.context, manager), IPortletRetriever)
+        return retriever.getPortlets()
+
     # Note: By passing in a parameter that's different for each portlet
     # manager, we avoid the view memoization (which is tied to the request)
     # caching the same portlets for all managers on the page. We cache the
@@ -103,9 +541,35 @@ class PortletManagerRenderer:
 
     @memoize
     def _lazyLoadPortlets(self, manager):
-        retriever = getMultiAdapter((self.context, manager), IPortletRetriever)
+        listener = self._getUtilities()[1]
+        portlets = timed(
+            listener,
+            manager.__name__,
+            "retrieval",
+            None,
+            partial(self._retrievePortlets, manager),
+        )
+        portlets = timed(
+            listener, manager.__name__, "filter", None, partial(self.filter, portlets)
+        )
+        environment = AvailabilityEnvironment(self.context, self.request)
         items = []
-        for p in self.filter(retriever.getPortlets()):
+        managerName = self.manager.__name__
+        for p in portlets:
+            # Skip portlets declared unavailable without looking up their
+            # renderers.
+            try:
+                if not isPortletAvailable(p["assignment"], environment):
+                    continue
+            except ConflictError:
+                raise
+            except Exception as e:
+                logger.exception(
+                    "Error while determining declared availability of portlet "
+                    "(%r %r %r): %s" % (p["category"], p["key"], p["name"], str(e))
+                )
+                continue
+
             renderer = self._dataToPortlet(p["assignment"].data)
             if renderer is None:
                 logger.warning(
@@ -115,15 +579,23 @@ class PortletManagerRenderer:
                     p["name"],
                 )
                 continue
-            info = p.copy()
-            info["manager"] = self.manager.__name__
-            info["renderer"] = renderer
-            hashPortletInfo(info)
-            # Record metadata on the renderer
-            renderer.__portlet_metadata__ = info.copy()
-            del renderer.__portlet_metadata__["renderer"]
+            # Record metadata on the renderer. The same record is returned,
+            # so only one is built for each portlet.
+            info = PortletInfo(
+                p,
+                manager=managerName,
+                hash=hashPortlet(managerName, p["category"], p["key"], p["name"]),
+                renderer=renderer,
+            )
+            renderer.__portlet_metadata__ = info
             try:
-                isAvailable = renderer.available
+                isAvailable = timed(
+                    listener,
+                    managerName,
+                    "availability",
+                    info["hash"],
+                    partial(getattr, renderer, "available"),
+                )
             except ConflictError:
                 raise
             except Exception as e:
@@ -138,14 +610,19 @@ class PortletManagerRenderer:
 
         return items
 
+    @memoize
+    def _portletsByHash(self, manager):
+        return {p["hash"]: p for p in self._lazyLoadPortlets(manager)}
+
     def _dataToPortlet(self, data):
         """Helper method to get the correct IPortletRenderer for the given
         data object.
         """
-        return queryMultiAdapter(
-            (self.context, self.request, self.__parent__, self.manager, data),
-            IPortletRenderer,
-        )
+        objects = (self.context, self.request, self.__parent__, self.manager, data)
+        factory = lookupRendererFactory(objects, IPortletRenderer)
+        if factory is None:
+            return None
+        return factory(*objects)
 
 
 @implementer(IPortletManager)
@@ -162,6 +639,25 @@ class PortletManager(PortletStorage):
         return getMultiAdapter((context, request, view, self), IPortletManagerRenderer)
 
     def getAddablePortletTypes(self):
+        # The addable portlet types only depend on the registered portlet
+        # types and the interfaces this manager provides. They are cached in
+        # a volatile attribute of the utility registry, which is dropped when
+        # the registry is changed by another ZODB client. Changes made in
+        # this process bump the portlet types generation.
+        registry = getSiteManager()
+        registry = getattr(registry, "utilities", registry)
+        generation = getPortletTypesGeneration()
+        cache = getattr(registry, "_v_addablePortletTypes", None)
+        if cache is None or cache[0] != generation:
+            cache = (generation, {})
+            registry._v_addablePortletTypes = cache
+        spec = providedBy(self)
+        addable = cache[1].get(spec, None)
+        if addable is None:
+            addable = cache[1][spec] = self._findAddablePortletTypes()
+        return list(addable)
+
+    def _findAddablePortletTypes(self):
         addable = []
         for p in getUtilitiesFor(IPortletType):
             # BBB - first condition, because starting with Plone 3.1
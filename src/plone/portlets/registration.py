@@ -1,4 +1,5 @@
 from persistent import Persistent
+from plone.portlets.cache import bumpPortletTypesGeneration
 from plone.portlets.interfaces import IPortletType
 from zope.interface import implementer
 
@@ -15,3 +16,9 @@ class PortletType(Persistent):
     addview = ""
     editview = None
     for_ = None
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name == "for_":
+            # Portlet managers cache the portlet types addable to them
+            bumpPortletTypesGeneration()
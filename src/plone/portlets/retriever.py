@@ -1,26 +1,197 @@
+from functools import lru_cache
+from plone.portlets.ancestry import getPortletAncestry
 from plone.portlets.constants import CONTEXT_ASSIGNMENT_KEY
 from plone.portlets.constants import CONTEXT_CATEGORY
-from plone.portlets.interfaces import ILocalPortletAssignable
-from plone.portlets.interfaces import ILocalPortletAssignmentManager
+from plone.portlets.info import PortletInfo
+from plone.portlets.inheritance import lookupInheritedPortlets
+from plone.portlets.interfaces import IIndexedPortletManager
+from plone.portlets.interfaces import IPlacelessPortletCache
 from plone.portlets.interfaces import IPlacelessPortletManager
-from plone.portlets.interfaces import IPortletAssignmentSettings
+from plone.portlets.interfaces import IPortletBatchRetriever
 from plone.portlets.interfaces import IPortletContext
 from plone.portlets.interfaces import IPortletManager
 from plone.portlets.interfaces import IPortletRetriever
-from zope.annotation.interfaces import IAnnotations
+from plone.portlets.interfaces import IPortletRetrieverCache
+from plone.portlets.settings import isAssignmentVisible
+from plone.portlets.storage import _coerce
 from zope.component import adapts
 from zope.component import getMultiAdapter
 from zope.component import queryAdapter
+from zope.component import queryUtility
 from zope.interface import implementer
 from zope.interface import Interface
 
 
+@lru_cache(maxsize=100)
+def _hasBlacklistStatuses(cls):
+    """Check whether the given ILocalPortletAssignmentManager class defines
+    getBlacklistStatuses() along with the getBlacklistStatus() it uses.
+
+    Subclasses overriding only getBlacklistStatus() would otherwise get the
+    answer of their base class.
+    """
+    getStatus = getStatuses = None
+    for klass in cls.__mro__:
+        if getStatus is None and "getBlacklistStatus" in klass.__dict__:
+            getStatus = klass
+        if getStatuses is None and "getBlacklistStatuses" in klass.__dict__:
+            getStatuses = klass
+    return getStatuses is not None and getStatuses is getStatus
+
+
+def _getBlacklistStatuses(lpam, categories):
+    """Get the blacklist statuses set by the given local portlet assignment
+    manager with a single call where possible.
+
+    Implementations of ILocalPortletAssignmentManager predating
+    getBlacklistStatuses(), or inheriting it from a class whose
+    getBlacklistStatus() they override, are asked for the context category
+    and each of the given categories instead.
+    """
+    if _hasBlacklistStatuses(type(lpam)):
+        return lpam.getBlacklistStatuses()
+    statuses = {CONTEXT_CATEGORY: lpam.getBlacklistStatus(CONTEXT_CATEGORY)}
+    for category in categories:
+        statuses[category] = lpam.getBlacklistStatus(category)
+    return statuses
+
+
+def _getGlobalMappings(storage, globalCategories):
+    """Get (category, key, mapping) tuples for the assignment mappings of the
+    given global categories that have assignments, in order.
+
+    Keys are checked against the summary of assigned keys kept by each
+    category mapping, so that e.g. the many groups of a user, only few of
+    which usually have portlets, do not all need to be looked up. Keys are
+    coerced the same way the category mapping coerces the keys it stores.
+    """
+    categoryMappings = {}
+    for category, key in globalCategories:
+        if category not in categoryMappings:
+            categoryMapping = storage.get(category, None)
+            assigned = None
+            if categoryMapping is not None:
+                assignedKeys = getattr(categoryMapping, "assignedKeys", None)
+                if assignedKeys is not None:
+                    assigned = assignedKeys()
+            categoryMappings[category] = (categoryMapping, assigned)
+        categoryMapping, assigned = categoryMappings[category]
+        if categoryMapping is None:
+            continue
+        if assigned is not None and _coerce(key) not in assigned:
+            continue
+        mapping = categoryMapping.get(key, None)
+        if mapping is not None:
+            yield category, key, mapping
+
+
+def _ancestorChain(context, pcontext):
+    """Get the given context and its parents, without acquisition wrappers.
+
+    Cached assignments are looked up by the uid of the context, but are only
+    valid for the content they were found for: content that is removed and
+    re-created, or moved into the place of other content, has the same uid.
+    """
+    chain = []
+    while pcontext is not None:
+        chain.append(getattr(context, "aq_base", context))
+        context = pcontext.getParent()
+        if context is None:
+            break
+        if IPortletContext.providedBy(context):
+            pcontext = context
+        else:
+            pcontext = queryAdapter(context, IPortletContext)
+    return tuple(chain)
+
+
+def _isSameChain(chain, other):
+    return len(chain) == len(other) and all(a is b for a, b in zip(chain, other))
+
+
+def _walkContextual(context, pcontext, managers):
+    """Walk the content hierarchy once to find the contextual assignments
+    for several portlet storages.
+
+    ``managers`` is a list of (storage, blacklisted) tuples, where
+    ``blacklisted`` is a dict with the global categories to determine the
+    blacklist status for as keys. It will be filled in. Returns a list of
+    (category, key, assignment) tuples for each storage, in the same order.
+    """
+
+    # Walk the content hierarchy to find out what blacklist status
+    # was assigned. Note that the blacklist is tri-state; if it's None it
+    # means no assertion has been made (i.e. the category has neither been
+    # whitelisted or blacklisted by this object or any parent). The first
+    # item to give either a blacklisted (True) or whitelisted (False)
+    # value for a given item will set the appropriate value. Parents of
+    # this item that also set a black- or white-list value will then be
+    # ignored.
+
+    # Whilst walking the hierarchy, we also collect parent portlets,
+    # until we hit the first block.
+
+    # Holds a list of (category, key, assignment) for each storage.
+    results = [[] for storage, blacklisted in managers]
+
+    blacklistFetched = [set() for storage, blacklisted in managers]
+    parentsBlocked = [False] * len(managers)
+    finished = [False] * len(managers)
+
+    for ancestor in getPortletAncestry(context, pcontext):
+        if ancestor.assignable is not None:
+            local = ancestor.annotations.get(CONTEXT_ASSIGNMENT_KEY, None)
+
+            for idx, (storage, blacklisted) in enumerate(managers):
+                if finished[idx]:
+                    continue
+
+                if not parentsBlocked[idx] and local is not None:
+                    # This is the name of the manager (column) we're rendering
+                    localManager = local.get(storage.__name__, None)
+                    if localManager is not None:
+                        results[idx].extend(
+                            [
+                                (CONTEXT_CATEGORY, ancestor.uid, a)
+                                for a in localManager.values()
+                            ]
+                        )
+
+                statuses = _getBlacklistStatuses(
+                    ancestor.assignmentManager(storage), blacklisted
+                )
+                if statuses.get(CONTEXT_CATEGORY, None):
+                    parentsBlocked[idx] = True
+                for cat, cat_status in blacklisted.items():
+                    local_status = statuses.get(cat, None)
+                    if local_status is not None:
+                        blacklistFetched[idx].add(cat)
+                        if cat_status is None:
+                            blacklisted[cat] = local_status
+
+        # We can stop looking at a storage if parents are blocked and we've
+        # fetched all blacklist statuses, and abort once that is the case
+        # for all of them.
+
+        for idx, (storage, blacklisted) in enumerate(managers):
+            if parentsBlocked[idx] and len(blacklistFetched[idx]) == len(blacklisted):
+                finished[idx] = True
+        if all(finished):
+            break
+
+    return results
+
+
 @implementer(IPortletRetriever)
 class PortletRetriever:
     """The default portlet retriever.
 
     This will examine the context and its parents for contextual portlets,
     provided they provide ILocalPortletAssignable.
+
+    If an IPortletRetrieverCache utility is registered, the result of the
+    hierarchy walk is cached per storage, context uid and global categories,
+    along with the context and its parents it is valid for.
     """
 
     adapts(Interface, IPortletManager)
@@ -30,8 +201,8 @@ class PortletRetriever:
         self.storage = storage
 
     def getPortlets(self):
-        """Work out which portlets to display, returning a list of dicts
-        describing assignments to render.
+        """Work out which portlets to display, returning a list of
+        PortletInfo records describing assignments to render.
         """
 
         if IPortletContext.providedBy(self.context):
@@ -42,119 +213,199 @@ class PortletRetriever:
         if pcontext is None:
             return []
 
-        # Holds a list of (category, key, assignment).
-        categories = []
+        globalCategories = pcontext.globalPortletCategories(False)
+
+        categories = self._getCachedCategories(pcontext, globalCategories)
+        if categories is None:
+            categories = self._cacheCategories(
+                pcontext,
+                globalCategories,
+                self._getCategories(pcontext, globalCategories),
+            )
+
+        return self._getAssignments(categories)
+
+    def _cacheKey(self, pcontext, globalCategories):
+        return (pcontext.uid, tuple(map(tuple, globalCategories)))
+
+    def _getCachedCategories(self, pcontext, globalCategories):
+        """Return the cached (category, key, assignment) tuples, or None if
+        there is no cache or no valid entry.
+        """
+        cache = queryUtility(IPortletRetrieverCache)
+        if cache is None:
+            return None
+        entry = cache.get(self.storage, self._cacheKey(pcontext, globalCategories))
+        if entry is None:
+            return None
+        chain, categories = entry
+        if not _isSameChain(chain, _ancestorChain(self.context, pcontext)):
+            return None
+        return categories
+
+    def _cacheCategories(self, pcontext, globalCategories, categories):
+        """Store the given (category, key, assignment) tuples in the cache,
+        if there is one, and return them.
+        """
+        categories = tuple(categories)
+        cache = queryUtility(IPortletRetrieverCache)
+        if cache is not None:
+            cache.set(
+                self.storage,
+                self._cacheKey(pcontext, globalCategories),
+                (_ancestorChain(self.context, pcontext), categories),
+            )
+        return categories
+
+    def _getCategories(self, pcontext, globalCategories):
+        """Return a list of (category, key, assignment) tuples for the
+        portlets that apply, before checking assignment visibility.
+        """
 
         # Keeps track of the blacklisting status for global categores
         # (user, group, content type). The status is either True (blocked)
         # or False (not blocked).
-        blacklisted = {}
-
-        # This is the name of the manager (column) we're rendering
-        manager = self.storage.__name__
+        blacklisted = self._getBlacklistCategories(globalCategories)
 
-        # 1. Fetch blacklisting status for each global category
+        if IIndexedPortletManager.providedBy(self.storage):
+            categories = self._getIndexedContextual(blacklisted)
+        else:
+            categories = self._getContextual(pcontext, blacklisted)
 
-        # First, find out which categories we will need to determine
-        # blacklist status for
+        return categories + self._getGlobal(globalCategories, blacklisted)
 
-        for category, key in pcontext.globalPortletCategories(False):
+    def _getBlacklistCategories(self, globalCategories):
+        """Find out which categories we will need to determine blacklist
+        status for. Returns a dict with an unknown (None) status for each.
+        """
+        blacklisted = {}
+        for category, key in globalCategories:
             blacklisted[category] = None
+        return blacklisted
 
-        # Then walk the content hierarchy to find out what blacklist status
-        # was assigned. Note that the blacklist is tri-state; if it's None it
-        # means no assertion has been made (i.e. the category has neither been
-        # whitelisted or blacklisted by this object or any parent). The first
-        # item to give either a blacklisted (True) or whitelisted (False)
-        # value for a given item will set the appropriate value. Parents of
-        # this item that also set a black- or white-list value will then be
-        # ignored.
-
-        # Whilst walking the hierarchy, we also collect parent portlets,
-        # until we hit the first block.
-
-        current = self.context
-        currentpc = pcontext
-        blacklistFetched = set()
-        parentsBlocked = False
-
-        while current is not None and currentpc is not None:
-            if ILocalPortletAssignable.providedBy(current):
-                assignable = current
-            else:
-                assignable = queryAdapter(current, ILocalPortletAssignable)
+    def _getContextual(self, pcontext, blacklisted):
+        """Walk the content hierarchy to find contextual assignments, and
+        fill in the blacklist status of global categories in ``blacklisted``.
+        """
+        return _walkContextual(self.context, pcontext, [(self.storage, blacklisted)])[0]
 
-            if assignable is not None:
-                if IAnnotations.providedBy(assignable):
-                    annotations = assignable
-                else:
-                    annotations = queryAdapter(assignable, IAnnotations)
-
-                if not parentsBlocked:
-                    local = annotations.get(CONTEXT_ASSIGNMENT_KEY, None)
-                    if local is not None:
-                        localManager = local.get(manager, None)
-                        if localManager is not None:
-                            categories.extend(
-                                [
-                                    (CONTEXT_CATEGORY, currentpc.uid, a)
-                                    for a in localManager.values()
-                                ]
-                            )
-
-                lpam = getMultiAdapter(
-                    (assignable, self.storage), ILocalPortletAssignmentManager
+    def _getIndexedContextual(self, blacklisted):
+        """Find contextual assignments and blacklist statuses using the
+        persistent index kept for IIndexedPortletManagers.
+        """
+        inherited = lookupInheritedPortlets(self.context, self.storage)
+        for category in blacklisted:
+            blacklisted[category] = inherited.blacklist.get(category, None)
+        return [(CONTEXT_CATEGORY, key, a) for key, a in inherited.assignments]
+
+    def _getGlobal(self, globalCategories, blacklisted):
+        """Get all global assignments for non-blacklisted categories."""
+        categories = []
+        globalCategories = [
+            (category, key)
+            for category, key in globalCategories
+            if not blacklisted[category]
+        ]
+        for category, key, mapping in _getGlobalMappings(
+            self.storage, globalCategories
+        ):
+            for a in mapping.values():
+                categories.append((category, key, a))
+        return categories
+
+    def _getAssignments(self, categories):
+        """Turn (category, key, assignment) tuples into the list of
+        PortletInfo records returned by getPortlets(), skipping invisible
+        assignments.
+        """
+        assignments = []
+        for category, key, assignment in categories:
+            if not isAssignmentVisible(assignment):
+                continue
+            assignments.append(
+                PortletInfo(
+                    category=category,
+                    key=key,
+                    name=str(assignment.__name__),
+                    assignment=assignment,
                 )
-                if lpam.getBlacklistStatus(CONTEXT_CATEGORY):
-                    parentsBlocked = True
-                for cat, cat_status in blacklisted.items():
-                    local_status = lpam.getBlacklistStatus(cat)
-                    if local_status is not None:
-                        blacklistFetched.add(cat)
-                        if cat_status is None:
-                            blacklisted[cat] = local_status
+            )
+        return assignments
 
-            # We can abort if parents are blocked and we've fetched all
-            # blacklist statuses
 
-            if parentsBlocked and len(blacklistFetched) == len(blacklisted):
-                break
+@implementer(IPortletBatchRetriever)
+class BatchPortletRetriever:
+    """The default batch portlet retriever.
 
-            # Check the parent - if there is no parent, we will stop
-            current = currentpc.getParent()
-            if current is not None:
-                if IPortletContext.providedBy(current):
-                    currentpc = current
-                else:
-                    currentpc = queryAdapter(current, IPortletContext)
+    Portlet managers which use the default PortletRetriever are resolved
+    with a single walk of the content hierarchy. For other portlet managers,
+    the IPortletRetriever registered for them is used.
+    """
 
-        # Get all global mappings for non-blacklisted categories
+    adapts(Interface)
 
-        for category, key in pcontext.globalPortletCategories(False):
-            if not blacklisted[category]:
-                mapping = self.storage.get(category, None)
-                if mapping is not None:
-                    for a in mapping.get(key, {}).values():
-                        categories.append((category, key, a))
+    def __init__(self, context):
+        self.context = context
 
-        assignments = []
-        for category, key, assignment in categories:
-            try:
-                settings = IPortletAssignmentSettings(assignment)
-                if not settings.get("visible", True):
+    def getPortlets(self, managers):
+        if IPortletContext.providedBy(self.context):
+            pcontext = self.context
+        else:
+            pcontext = queryAdapter(self.context, IPortletContext)
+
+        results = {}
+        retrievers = []
+        for manager in managers:
+            retriever = getMultiAdapter((self.context, manager), IPortletRetriever)
+            if pcontext is not None and type(retriever) is PortletRetriever:
+                retrievers.append(retriever)
+            else:
+                results[manager.__name__] = retriever.getPortlets()
+
+        if not retrievers:
+            return results
+
+        globalCategories = pcontext.globalPortletCategories(False)
+
+        # Use cached results where possible. Indexed managers do not need
+        # to walk the hierarchy, so they are not included in the walk.
+        walking = []
+        for retriever in retrievers:
+            categories = retriever._getCachedCategories(pcontext, globalCategories)
+            if categories is None:
+                if IIndexedPortletManager.providedBy(retriever.storage):
+                    categories = retriever._cacheCategories(
+                        pcontext,
+                        globalCategories,
+                        retriever._getCategories(pcontext, globalCategories),
+                    )
+                else:
+                    walking.append(
+                        (retriever, retriever._getBlacklistCategories(globalCategories))
+                    )
                     continue
-            except TypeError:
-                # Portlet does not exist any longer
-                continue
-            assignments.append(
-                {
-                    "category": category,
-                    "key": key,
-                    "name": str(assignment.__name__),
-                    "assignment": assignment,
-                }
+            results[retriever.storage.__name__] = retriever._getAssignments(categories)
+
+        if walking:
+            contextuals = _walkContextual(
+                self.context,
+                pcontext,
+                [
+                    (retriever.storage, blacklisted)
+                    for retriever, blacklisted in walking
+                ],
             )
-        return assignments
+            for (retriever, blacklisted), contextual in zip(walking, contextuals):
+                categories = retriever._cacheCategories(
+                    pcontext,
+                    globalCategories,
+                    contextual + retriever._getGlobal(globalCategories, blacklisted),
+                )
+                results[retriever.storage.__name__] = retriever._getAssignments(
+                    categories
+                )
+
+        return results
 
 
 @implementer(IPortletRetriever)
@@ -162,6 +413,9 @@ class PlacelessPortletRetriever(PortletRetriever):
     """A placeless portlet retriever.
 
     This will aggregate user portlets, then group portlets.
+
+    If an IPlacelessPortletCache utility is registered, the assignments found
+    are cached per principal, i.e. per set of placeless global categories.
     """
 
     adapts(Interface, IPlacelessPortletManager)
@@ -179,27 +433,32 @@ class PlacelessPortletRetriever(PortletRetriever):
         if pcontext is None:
             return []
 
-        assignments = []
-        for category, key in pcontext.globalPortletCategories(True):
-            mapping = self.storage.get(category, None)
-            if mapping is not None:
-                for assignment in mapping.get(key, {}).values():
-                    try:
-                        settings = IPortletAssignmentSettings(assignment)
-                    except TypeError:
-                        # Portlet does not exist any longer
-                        continue
-                    else:
-                        if not settings.get("visible", True):
-                            continue
-
-                    assignments.append(
-                        {
-                            "category": category,
-                            "key": key,
-                            "name": assignment.__name__,
-                            "assignment": assignment,
-                        }
-                    )
+        globalCategories = pcontext.globalPortletCategories(True)
 
-        return assignments
+        cache = queryUtility(IPlacelessPortletCache)
+        if cache is None:
+            categories = self._getPlacelessCategories(globalCategories)
+        else:
+            key = tuple(map(tuple, globalCategories))
+            categories = cache.get(self.storage, key)
+            if categories is None:
+                categories = cache.set(
+                    self.storage,
+                    key,
+                    tuple(self._getPlacelessCategories(globalCategories)),
+                )
+
+        return self._getAssignments(categories)
+
+    def _getPlacelessCategories(self, globalCategories):
+        """Return a list of (category, key, assignment) tuples for the user
+        and group portlets of the given categories, before checking
+        assignment visibility.
+        """
+        categories = []
+        for category, key, mapping in _getGlobalMappings(
+            self.storage, globalCategories
+        ):
+            for assignment in mapping.values():
+                categories.append((category, key, assignment))
+        return categories
@@ -15,10 +15,13 @@ class PortletAssignmentSettings(Contained):
         self.data = PersistentMapping()
 
     def __setitem__(self, name, value):
+        self._store()
         self.data[name] = value
+        self._changed(name)
 
     def __delitem__(self, name):
         del self.data[name]
+        self._changed(name)
 
     def __getitem__(self, name):
         return self.data.__getitem__(name)
@@ -26,6 +29,26 @@ class PortletAssignmentSettings(Contained):
     def get(self, name, default=None):
         return self.data.get(name, default)
 
+    def _store(self):
+        # Settings are only stored in the annotations of the assignment once
+        # they are first written, so that reading them never writes to the
+        # database.
+        assignment = self.__parent__
+        if assignment is None:
+            return
+        annotations = queryAdapter(assignment, IAnnotations)
+        if annotations.get(ASSIGNMENT_SETTINGS_KEY, None) is not self:
+            annotations[ASSIGNMENT_SETTINGS_KEY] = self
+
+    def _changed(self, name):
+        # Let the assignment mapping know about changes in visibility, so
+        # that it can keep track of hidden assignments.
+        if name != "visible" or self.__parent__ is None:
+            return
+        mapping = getattr(self.__parent__, "__parent__", None)
+        if hasattr(mapping, "_updateHiddenAssignment"):
+            mapping._updateHiddenAssignment(self.__parent__.__name__)
+
 
 @adapter(IPortletAssignment)
 @implementer(IPortletAssignmentSettings)
@@ -34,6 +57,35 @@ def portletAssignmentSettingsFactory(context):
     settings = annotations.get(ASSIGNMENT_SETTINGS_KEY, None)
 
     if settings is None:
-        settings = annotations[ASSIGNMENT_SETTINGS_KEY] = PortletAssignmentSettings()
+        # Not stored until the first setting is written.
+        settings = PortletAssignmentSettings()
 
+    # Settings objects are not persistent themselves, so this does not
+    # cause a write. It allows them to find their assignment when changed.
+    # They are pickled along with the annotations of the assignment, so
+    # acquisition wrappers, if any, must not be stored.
+    settings.__parent__ = getattr(context, "aq_base", context)
     return settings
+
+
+def isAssignmentVisible(assignment, useMapping=True):
+    """Determine whether the given assignment is visible, according to its
+    IPortletAssignmentSettings, without writing to the database.
+
+    If ``useMapping`` is True and the assignment mapping containing the
+    assignment keeps track of hidden assignments, this is answered without
+    loading the settings. Returns False for assignments which can no longer
+    be loaded.
+    """
+    if not IPortletAssignment.providedBy(assignment):
+        # Portlet does not exist any longer
+        return False
+    if useMapping:
+        mapping = getattr(assignment, "__parent__", None)
+        hidden = getattr(mapping, "_hiddenAssignments", None)
+        if hidden is not None:
+            return assignment.__name__ not in hidden
+    settings = queryAdapter(assignment, IPortletAssignmentSettings)
+    if settings is None:
+        return False
+    return bool(settings.get("visible", True))
@@ -1,13 +1,25 @@
+from BTrees.LOBTree import LOBTree
+from BTrees.OLBTree import OLBTree
 from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from plone.portlets.interfaces import IPortletAssignmentMapping
 from plone.portlets.interfaces import IPortletCategoryMapping
 from plone.portlets.interfaces import IPortletStorage
+from plone.portlets.settings import isAssignmentVisible
+from ZODB.interfaces import IBroken
 from zope.container.btree import BTreeContainer
+from zope.container.contained import checkAndConvertName
 from zope.container.contained import Contained
+from zope.container.contained import containedEvent
+from zope.container.contained import notifyContainerModified
+from zope.container.contained import ObjectRemovedEvent
+from zope.container.contained import uncontained
 from zope.container.ordered import OrderedContainer
+from zope.event import notify
 from zope.interface import implementer
 
 import logging
+import random
 
 LOG = logging.getLogger("portlets")
 
@@ -29,6 +41,67 @@ def _coerce(key):
     return key
 
 
+_marker = object()
+
+
+def _prepareAddMany(container, items, coerce=None):
+    """Check the given (name, object) pairs before adding them to the given
+    container, like zope.container.contained.setitem() does.
+
+    Returns a list of (name, object, event) tuples for the objects to be
+    added, where ``event`` is the event to fire once the object has been
+    added, or None. Objects already stored under their name are skipped.
+    Nothing is returned if any of the names is invalid or already in use.
+    """
+    pending = []
+    names = set()
+    for name, object in items:
+        if coerce is not None:
+            name = coerce(name)
+        name = checkAndConvertName(name)
+        old = container.get(name, _marker)
+        if old is object:
+            continue
+        if old is not _marker or name in names:
+            raise KeyError(name)
+        names.add(name)
+        pending.append((name, object))
+    added = []
+    for name, object in pending:
+        object, event = containedEvent(object, container, name)
+        added.append((name, object, event))
+    return added
+
+
+def _prepareRemoveMany(container, names, coerce=None):
+    """Get the (name, object) pairs for the given names of the given
+    container, raising a KeyError if any of them does not exist.
+    """
+    removed = []
+    seen = set()
+    for name in names:
+        if coerce is not None:
+            name = coerce(name)
+        if name in seen:
+            continue
+        seen.add(name)
+        removed.append((name, container[name]))
+    return removed
+
+
+def _notifyRemoved(container, removed):
+    """Fire the events for the removal of the given (name, object) pairs
+    from the given container, like zope.container.contained.uncontained()
+    does, and clear the location of the objects.
+    """
+    for name, object in removed:
+        notify(ObjectRemovedEvent(object, container, name))
+    for name, object in removed:
+        if not IBroken.providedBy(object):
+            object.__parent__ = None
+            object.__name__ = None
+
+
 @implementer(IPortletStorage)
 class PortletStorage(BTreeContainer):
     """The default portlet storage."""
@@ -38,6 +111,17 @@ class PortletStorage(BTreeContainer):
 class PortletCategoryMapping(BTreeContainer, Contained):
     """The default category/key mapping storage."""
 
+    # A summary of the keys that have a non-empty assignment mapping, kept
+    # in its own OOTreeSet, so that changes to it do not rewrite the state of
+    # the category mapping, and concurrent changes for different keys are
+    # resolved. None (or a frozenset, as stored by earlier development
+    # versions) if it has not been computed yet, see migrateAssignedKeys().
+    _assignedKeys = None
+
+    def __init__(self):
+        super().__init__()
+        self._assignedKeys = OOTreeSet()
+
     # We need to hack some stuff to make sure keys are unicode.
     # The shole BTreeContainer/SampleContainer mess is a pain in the backside
 
@@ -56,27 +140,407 @@ class PortletCategoryMapping(BTreeContainer, Contained):
 
     def __setitem__(self, key, object):
         """See interface `IWriteContainer`"""
-        super().__setitem__(_coerce(key), object)
+        key = _coerce(key)
+        super().__setitem__(key, object)
+        self._updateAssignedKey(key)
 
     def __delitem__(self, key):
         """See interface `IWriteContainer`"""
-        super().__delitem__(_coerce(key))
+        key = _coerce(key)
+        super().__delitem__(key)
+        self._updateAssignedKey(key)
+
+    def assignedKeys(self):
+        """See interface `IPortletCategoryMapping`
+
+        The set returned must not be modified.
+        """
+        if not isinstance(self._assignedKeys, OOTreeSet):
+            return None
+        return self._assignedKeys
+
+    def migrateAssignedKeys(self):
+        """Compute the summary of assigned keys for a category mapping
+        created by an older version, loading all its assignment mappings.
+
+        Until this is called, every key is looked up. Returns True if the
+        summary was computed, or False if it was already there.
+        """
+        if isinstance(self._assignedKeys, OOTreeSet):
+            return False
+        self._assignedKeys = OOTreeSet(
+            k for k, mapping in self.items() if len(mapping) > 0
+        )
+        return True
+
+    def addMany(self, items):
+        """Add the given (key, assignment mapping) pairs at once.
+
+        The same events are fired as when adding them one by one, except
+        that the container is only notified of modification once, and the
+        summary of assigned keys is only updated once. Returns the keys of
+        the mappings added.
+        """
+        added = _prepareAddMany(self, items, _coerce)
+        for key, mapping, event in added:
+            self._setitemf(key, mapping)
+        self._updateAssignedKeys(key for key, mapping, event in added)
+        events = [event for key, mapping, event in added if event]
+        for event in events:
+            notify(event)
+        if events:
+            notifyContainerModified(self)
+        return [key for key, mapping, event in added]
+
+    def removeMany(self, keys):
+        """Remove the assignment mappings with the given keys at once.
+
+        As for addMany(), the container is only notified of modification
+        once.
+        """
+        removed = _prepareRemoveMany(self, keys, _coerce)
+        if not removed:
+            return
+        _notifyRemoved(self, removed)
+        for key, mapping in removed:
+            super().__delitem__(key)
+        self._updateAssignedKeys(key for key, mapping in removed)
+        notifyContainerModified(self)
+
+    def _updateAssignedKeys(self, keys):
+        """Update the summary of assigned keys for several keys."""
+        for key in keys:
+            self._updateAssignedKey(key)
+
+    def _updateAssignedKey(self, key):
+        """Update the summary of assigned keys after the assignment mapping
+        stored under the given key was added, removed or modified.
+
+        The summary is only written when it changes, i.e. when a key gains
+        its first or loses its last assignment. Category mappings without a
+        summary are left alone, see migrateAssignedKeys().
+        """
+        assignedKeys = self._assignedKeys
+        if not isinstance(assignedKeys, OOTreeSet):
+            return
+        mapping = self.get(key, None)
+        if mapping is not None and len(mapping) > 0:
+            if key not in assignedKeys:
+                assignedKeys.add(key)
+        elif key in assignedKeys:
+            assignedKeys.remove(key)
+
+
+def _increasingSubsequence(values):
+    """Get the indexes of a longest strictly increasing subsequence of the
+    given values.
+    """
+    tails = []  # indexes of the smallest tail of subsequences by length
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if values[tails[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[i] = tails[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(i)
+        else:
+            tails[lo] = i
+    result = []
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.append(i)
+        i = previous[i]
+    return result[::-1]
+
+
+class OrderedBTreeContainer(OrderedContainer):
+    """An ordered container which keeps its order in BTrees.
+
+    OrderedContainer keeps the order in a persistent list, which is written
+    as a whole whenever an item is added, removed or moved, so that any two
+    concurrent changes conflict. Here, each key has a rank, an integer
+    stored in ``_ranks`` (mapping ranks to keys) and ``_positions`` (mapping
+    keys to ranks). Ranks are spaced apart, so that items can be added and
+    moved by writing only their own ranks, and the BTrees can resolve
+    concurrent changes to different keys.
+
+    Containers created before this was introduced keep using their
+    ``_order`` list until they are first changed, when they are migrated.
+    """
+
+    # The gap between the ranks of items added at the end
+    rankStep = 2**24
+
+    _order = None
+    _positions = None
+    _ranks = None
+
+    def __init__(self):
+        self._data = OOBTree()
+        self._positions = OLBTree()
+        self._ranks = LOBTree()
+
+    def keys(self):
+        if self._ranks is None:
+            return self._order[:]
+        return list(self._ranks.values())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return [self._data[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self._data[key]) for key in self.keys()]
+
+    def _setitemf(self, key, value):
+        if key not in self._data:
+            self._appendKeys([key])
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        uncontained(self._data[key], self, key)
+        del self._data[key]
+        self._removeKeys([key])
+
+    def updateOrder(self, order):
+        if not isinstance(order, (list, tuple)):
+            raise TypeError("order must be a tuple or a list.")
+        keys = self.keys()
+        if len(order) != len(keys):
+            raise ValueError("Incompatible key set.")
+        order = [checkAndConvertName(x) for x in order]
+        if frozenset(order) != frozenset(keys):
+            raise ValueError("Incompatible key set.")
+        if order == keys:
+            return
+        self._reorderKeys(order)
+        notifyContainerModified(self)
+
+    def migrateOrder(self):
+        """Move the order of a container created by an older version from
+        its ``_order`` list to the BTrees. Returns True if it was migrated.
+        """
+        if self._ranks is not None:
+            return False
+        order = list(self._order or ())
+        self._positions = OLBTree()
+        self._ranks = LOBTree()
+        if "_order" in self.__dict__:
+            del self._order
+        self._appendKeys(order)
+        return True
+
+    def _setRank(self, key, rank):
+        old = self._positions.get(key, None)
+        if old == rank:
+            return
+        if old is not None and self._ranks.get(old, None) == key:
+            del self._ranks[old]
+        self._positions[key] = rank
+        self._ranks[rank] = key
+
+    def _appendKeys(self, keys):
+        self.migrateOrder()
+        rank = self._ranks.maxKey() if self._ranks else 0
+        for key in keys:
+            # Spread out the ranks of items added concurrently at the end,
+            # so that they are unlikely to clash.
+            rank += self.rankStep // 2 + random.randrange(self.rankStep // 2)
+            self._setRank(key, rank)
+
+    def _removeKeys(self, keys):
+        self.migrateOrder()
+        for key in keys:
+            rank = self._positions.pop(key, None)
+            if rank is not None and self._ranks.get(rank, None) == key:
+                del self._ranks[rank]
+
+    def _reorderKeys(self, order):
+        """Give the keys ranks in the given order, changing as few ranks as
+        possible.
+        """
+        self.migrateOrder()
+        ranks = [self._positions[key] for key in order]
+        keep = _increasingSubsequence(ranks)
+
+        # Give the keys between two kept ones evenly spaced ranks between
+        # theirs, or renumber all keys if there is no room.
+        changes = []
+        bounds = [-1] + keep + [len(order)]
+        for start, end in zip(bounds, bounds[1:]):
+            count = end - start - 1
+            if not count:
+                continue
+            lo = ranks[start] if start >= 0 else None
+            hi = ranks[end] if end < len(order) else None
+            if lo is None and hi is None:
+                lo, hi = 0, (count + 1) * self.rankStep
+            elif lo is None:
+                lo = hi - (count + 1) * self.rankStep
+            elif hi is None:
+                hi = lo + (count + 1) * self.rankStep
+            step = (hi - lo) // (count + 1)
+            if step < 1:
+                changes = None
+                break
+            for i in range(count):
+                changes.append((order[start + 1 + i], lo + step * (i + 1)))
+
+        if changes is None:
+            changes = [(key, (i + 1) * self.rankStep) for i, key in enumerate(order)]
+            self._positions.clear()
+            self._ranks.clear()
+        else:
+            # Remove the old ranks first, as they may be re-used.
+            for key, rank in changes:
+                del self._ranks[self._positions[key]]
+                del self._positions[key]
+        for key, rank in changes:
+            self._setRank(key, rank)
 
 
 @implementer(IPortletAssignmentMapping)
-class PortletAssignmentMapping(OrderedContainer):
+class PortletAssignmentMapping(OrderedBTreeContainer):
     """The default assignment mapping storage."""
 
     __manager__ = ""
     __category__ = ""
     __name__ = ""
 
+    # The names of assignments which are hidden through their
+    # IPortletAssignmentSettings, or None if this has not been computed yet
+    # (e.g. for mappings created by an older version).
+    _hiddenAssignments = None
+
     def __init__(self, manager="", category="", name=""):
-        # XXX: This depends on implementation detail in OrderedContainer,
-        # but it uses a PersistentMapping, which sucks :-/
-        OrderedContainer.__init__(self)
-        self._data = OOBTree()
+        OrderedBTreeContainer.__init__(self)
+        self._hiddenAssignments = frozenset()
 
         self.__manager__ = manager
         self.__category__ = category
         self.__name__ = name
+
+    def __setitem__(self, key, object):
+        """See interface `IWriteContainer`"""
+        key = super().__setitem__(key, object)
+        self._updateHiddenAssignment(key)
+        self._assignmentsChanged()
+        return key
+
+    def __delitem__(self, key):
+        """See interface `IWriteContainer`"""
+        super().__delitem__(key)
+        self._updateHiddenAssignment(key)
+        self._assignmentsChanged()
+
+    def addMany(self, items):
+        """Add the given (name, assignment) pairs at once, after any
+        existing assignments.
+
+        The same events are fired for each assignment as when adding them
+        one by one, but the order is only written once, the container is
+        only notified of modification once, and the work done by this
+        package's event handlers, such as updating the inherited portlets
+        index, is done once for all of them. Returns the names of the
+        assignments added.
+        """
+        added = _prepareAddMany(self, items)
+        if not added:
+            return []
+        names = [name for name, assignment, event in added]
+        for name, assignment, event in added:
+            self._data[name] = assignment
+        self._appendKeys(names)
+        self._updateHiddenAssignments(names)
+        self._assignmentsChanged()
+
+        # Event handlers can tell that a bulk change is in progress by this
+        # attribute, which holds the names of removed assignments, and
+        # defer their work to the container modified event.
+        self._v_bulkChange = ()
+        try:
+            for name, assignment, event in added:
+                if event:
+                    notify(event)
+            notifyContainerModified(self)
+        finally:
+            del self._v_bulkChange
+        return names
+
+    def removeMany(self, names):
+        """Remove the assignments with the given names at once.
+
+        As for addMany(), the order is only written once, and the container
+        is only notified of modification once.
+        """
+        removed = _prepareRemoveMany(self, names)
+        if not removed:
+            return
+        names = [name for name, assignment in removed]
+        self._v_bulkChange = tuple(names)
+        try:
+            _notifyRemoved(self, removed)
+            for name in names:
+                del self._data[name]
+            self._removeKeys(names)
+            self._updateHiddenAssignments(names)
+            self._assignmentsChanged()
+            notifyContainerModified(self)
+        finally:
+            del self._v_bulkChange
+
+    def _updateHiddenAssignments(self, names):
+        """Update the names of hidden assignments for several names, writing
+        them at most once.
+        """
+        if self._hiddenAssignments is None:
+            self._updateHiddenAssignment(None)
+            return
+        hidden = set(self._hiddenAssignments)
+        for name in names:
+            assignment = self.get(name, None)
+            if assignment is not None and not isAssignmentVisible(
+                assignment, useMapping=False
+            ):
+                hidden.add(name)
+            else:
+                hidden.discard(name)
+        if hidden != self._hiddenAssignments:
+            self._hiddenAssignments = frozenset(hidden)
+
+    def _updateHiddenAssignment(self, key):
+        """Update the names of hidden assignments after the assignment
+        stored under the given key was added, removed or had its visibility
+        changed.
+        """
+        if self._hiddenAssignments is None:
+            self._hiddenAssignments = frozenset(
+                name
+                for name, assignment in self.items()
+                if not isAssignmentVisible(assignment, useMapping=False)
+            )
+            return
+        assignment = self.get(key, None)
+        hidden = assignment is not None and not isAssignmentVisible(
+            assignment, useMapping=False
+        )
+        if hidden and key not in self._hiddenAssignments:
+            self._hiddenAssignments = self._hiddenAssignments | {key}
+        elif not hidden and key in self._hiddenAssignments:
+            self._hiddenAssignments = self._hiddenAssignments - {key}
+
+    def _assignmentsChanged(self):
+        # Let the category mapping we are stored in know, so that it can
+        # keep track of the keys that have assignments.
+        parent = self.__parent__
+        if IPortletCategoryMapping.providedBy(parent) and hasattr(
+            parent, "_updateAssignedKey"
+        ):
+            parent._updateAssignedKey(self.__name__)
@@ -168,6 +168,19 @@ def test_portlet_metadata_availability():
     assert renderer.render() == "dummy portlet renderer"
 
 
+def test_benchmark():
+    # Run the benchmarks with a tiny hierarchy, to make sure they still work
+    from plone.portlets.benchmark import runBenchmarks
+
+    results = runBenchmarks(depth=2, groups=3, repeat=2, blockEvery=2, cache=True)
+    assert sorted(results["results"]) == [
+        "PlacelessPortletRetriever.getPortlets",
+        "PortletManagerRenderer._lazyLoadPortlets",
+        "PortletRetriever.getPortlets",
+    ]
+    assert results["results"]["PortletRetriever.getPortlets"]["runs"] == 2
+
+
 def test_suite():
     return unittest.TestSuite(
         (
@@ -183,6 +196,18 @@ def test_suite():
                 tearDown=configurationTearDown,
                 optionflags=optionflags,
             ),
+            doctest.DocFileSuite(
+                "caching.txt",
+                setUp=configurationSetUp,
+                tearDown=configurationTearDown,
+                optionflags=optionflags,
+            ),
+            doctest.DocFileSuite(
+                "rendering.txt",
+                setUp=configurationSetUp,
+                tearDown=configurationTearDown,
+                optionflags=optionflags,
+            ),
             doctest.DocFileSuite(
                 "utils.txt",
                 setUp=configurationSetUp,
@@ -195,5 +220,10 @@ def test_suite():
                 setUp=configurationSetUp,
                 tearDown=configurationTearDown,
             ),
+            unittest.FunctionTestCase(
+                test_benchmark,
+                setUp=configurationSetUp,
+                tearDown=configurationTearDown,
+            ),
         )
     )
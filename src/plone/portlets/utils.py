@@ -1,3 +1,4 @@
+from functools import lru_cache
 from plone.portlets.interfaces import IPortletType
 from plone.portlets.registration import PortletType
 from zope.component import getSiteManager
@@ -47,15 +48,28 @@ def hashPortletInfo(info):
     info is the portlet info dictionary. Hash is put into info, and
     also returned.
     """
-    # Make sure all info values are decoded
-    newinfo = {}
-    for k, v in info.items():
+    info["hash"] = hashPortlet(
+        info["manager"], info["category"], info["key"], info["name"]
+    )
+    return info["hash"]
+
+
+@lru_cache(maxsize=10000)
+def hashPortlet(manager, category, key, name):
+    """Creates the same hash as hashPortletInfo() from the individual
+    values, without needing an info dictionary.
+
+    Hashes only change when assignments are renamed or moved, so they are
+    kept in a bounded cache rather than computed for every portlet shown.
+    """
+    # Make sure all values are decoded
+    values = []
+    for v in (manager, category, key, name):
         if hasattr(v, "decode"):
             v = v.decode("utf8")
-        newinfo[k] = v
-    concat_txt = "%(manager)s\n%(category)s\n%(key)s\n%(name)s" % newinfo
-    info["hash"] = binascii.b2a_hex(concat_txt.encode("utf8"))
-    return info["hash"]
+        values.append(v)
+    concat_txt = "%s\n%s\n%s\n%s" % tuple(values)
+    return binascii.b2a_hex(concat_txt.encode("utf8"))
 
 
 def unhashPortletInfo(hash):
@@ -64,7 +78,12 @@ def unhashPortletInfo(hash):
     Output is the info dictionary (containing only the
     hashed fields).
     """
-    concat_txt = binascii.a2b_hex(hash).decode()
-    manager, category, key, name = concat_txt.splitlines()
+    manager, category, key, name = _unhashPortlet(hash)
     info = dict(manager=manager, category=category, key=key, name=name, hash=hash)
     return info
+
+
+@lru_cache(maxsize=10000)
+def _unhashPortlet(hash):
+    concat_txt = binascii.a2b_hex(hash).decode()
+    return tuple(concat_txt.splitlines())